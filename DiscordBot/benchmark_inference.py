@@ -0,0 +1,59 @@
+# Compares the plain HF pipeline against the length-bucketed InferenceEngine on synthetic Discord-like traffic.
+# Usage: python benchmark_inference.py [number of messages]
+import random
+import sys
+import time
+
+from transformers import pipeline
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from inference import InferenceEngine
+
+WORDS = "lol gg ok the you we they are going to be at school tomorrow this game is so bad kill shoot " \
+        "fight them all I can't believe what happened last night nobody cares honestly".split()
+SHORT_REPLIES = ["lol", "gg", "ok", "lmao", "same", "wait what", "no way", "yes"]
+
+
+def synthetic_messages(n: int, seed: int = 152):
+    '''
+    Mostly short chat lines, some medium messages and a few long copypastas.
+    '''
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.4:
+            messages.append(rng.choice(SHORT_REPLIES))
+        elif r < 0.9:
+            messages.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))))
+        else:
+            messages.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(100, 400))))
+    return messages
+
+
+def count_tokens(tokenizer, messages, max_length):
+    return sum(len(tokenizer(m, truncation=True, max_length=max_length)['input_ids']) for m in messages)
+
+
+def run(name, classify, messages, tokens):
+    start = time.perf_counter()
+    classify(messages)
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed:.2f}s, {len(messages) / elapsed:.1f} msgs/s, {tokens / elapsed:.0f} tokens/s")
+    return elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    model = AutoModelForSequenceClassification.from_pretrained('best_model', num_labels=2)
+    tokenizer = AutoTokenizer.from_pretrained('distilbert-base-uncased')
+    messages = synthetic_messages(n)
+    engine = InferenceEngine(model, tokenizer)
+    tokens = count_tokens(tokenizer, messages, engine.max_length)
+    print(f"{n} messages, {tokens} real tokens")
+
+    nlp = pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+    baseline = run("pipeline (one at a time)", lambda m: nlp(m, truncation=True, max_length=engine.max_length), messages, tokens)
+    padded = run("pipeline (batch_size=32)", lambda m: nlp(m, batch_size=32, truncation=True, max_length=engine.max_length), messages, tokens)
+    bucketed = run("bucketed engine", engine, messages, tokens)
+    print(f"speedup vs one at a time: {baseline / bucketed:.2f}x, vs padded batches: {padded / bucketed:.2f}x")
@@ -0,0 +1,86 @@
+# Measures how much the preprocessing in handle_image.py speeds up Tesseract and how much the text changes.
+# Besides the images in the directory, a few generated screenshots are always included, like tall dark-mode
+# phone screenshots with only a line or two of text, which preprocessing must not mistake for textless images.
+# Usage: python benchmark_ocr.py [directory of fixture images]
+import difflib
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+import pytesseract
+
+from handle_image import image_to_text
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+DARK_MODE_BACKGROUND = (54, 57, 63)
+DARK_MODE_TEXT = (220, 221, 222)
+
+
+def screenshot(lines, size=(1080, 2400), background=DARK_MODE_BACKGROUND, color=DARK_MODE_TEXT) -> Image.Image:
+    '''
+    A phone screenshot that is empty apart from a few lines of chat text in the middle.
+    '''
+    image = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype('DejaVuSans.ttf', 40)
+    except OSError:
+        font = ImageFont.load_default()
+    for n, line in enumerate(lines):
+        draw.text((60, size[1] // 2 + n * 60), line, fill=color, font=font)
+    return image
+
+
+def generated_fixtures():
+    return [
+        ('dark-mode-1-line.png', screenshot(["i'm bringing a gun to school tomorrow"])),
+        ('dark-mode-3-lines.png', screenshot(["hey", "i'm bringing a gun to school tomorrow", "don't tell anyone"])),
+        ('light-mode-1-line.png', screenshot(["you will regret it"], background=(255, 255, 255), color=(6, 6, 7))),
+    ]
+
+
+def agreement(a: str, b: str) -> float:
+    '''
+    Character-level similarity of two OCR outputs, ignoring differences in whitespace.
+    '''
+    a, b = ' '.join(a.split()), ' '.join(b.split())
+    if not a and not b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("Usage: python benchmark_ocr.py [directory of fixture images]")
+        sys.exit(1)
+    fixtures = generated_fixtures()
+    if len(sys.argv) == 2:
+        for f in sorted(os.listdir(sys.argv[1])):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                image = Image.open(os.path.join(sys.argv[1], f))
+                image.load()
+                fixtures.append((f, image))
+    baseline_total, processed_total, agreements, skipped = 0.0, 0.0, [], 0
+    for name, image in fixtures:
+        start = time.perf_counter()
+        baseline = pytesseract.image_to_string(image)
+        baseline_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        processed = image_to_text(image)
+        processed_time = time.perf_counter() - start
+
+        baseline_total += baseline_time
+        processed_total += processed_time
+        agreements.append(agreement(baseline, processed))
+        if not processed and baseline.strip():
+            skipped += 1
+        print(f"{name} {image.size[0]}x{image.size[1]}: "
+              f"{baseline_time * 1000:.0f}ms -> {processed_time * 1000:.0f}ms, agreement {agreements[-1]:.1%}")
+
+    if fixtures:
+        print(f"{len(fixtures)} images: baseline {baseline_total:.2f}s, preprocessed {processed_total:.2f}s "
+              f"({baseline_total / max(processed_total, 1e-9):.2f}x faster)")
+        print(f"mean agreement {sum(agreements) / len(agreements):.1%}, "
+              f"{skipped} images skipped as textless where the baseline found text")
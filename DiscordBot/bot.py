@@ -1,59 +1,201 @@
 # bot.py
-from typing import Dict
+import time
+START_TIME = time.perf_counter()
 import discord
 import os
 import json
+import argparse
+import importlib
 import logging
+import logging.handlers
+import queue
 import re
-import requests
-from handle_image import get_text_from_attachment
-from mod_flow import Incident
-from report import Report, ThreatLevel 
-from transformers import pipeline
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-
-# Set up logging to the console
+import asyncio
+from typing import Union
+from classifier import ClassificationService, RemoteClassifier
+from dispatcher import Dispatcher
+from incident_store import IncidentStore
+from metrics import CLASSIFICATIONS, Gauge, monitor_loop_lag, start_server, timed
+from mod_flow import Incident, ModState
+from prefilter import LexiconStage, LinearStage, Prefilter, load_lexicon
+from report import MessageSnapshot, Report, ThreatLevel 
+from report_sessions import MessageCache, ReportSessions
+from triage import TriageQueue
+from verdict_cache import VerdictCache, content_key, model_fingerprint
+# transformers/torch, PIL and pytesseract are imported in ModBot.load_models, after the gateway is connecting
+
 logger = logging.getLogger('discord')
 logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
-
-# There should be a file called 'token.json' inside the same folder as this file
-token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
-    perspective_key = tokens['perspective']
-
-
-class ModBot(discord.Client):
-    def __init__(self, key):
+# Each bot process needs its own log file (run_sharded.py passes --log-path)
+LOG_PATH = 'discord.log'
+
+def start_logging(path: str = LOG_PATH) -> logging.handlers.QueueListener:
+    '''
+    Set up logging to the file at `path`. Records are put on a queue and written to the file by a
+    background thread, so logging never blocks the event loop.
+    '''
+    handler = logging.FileHandler(filename=path, encoding='utf-8', mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+    log_queue = queue.Queue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, handler)
+    log_listener.start()
+    return log_listener
+
+# Prometheus-style metrics are served at http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9152 # None turns the endpoint off
+
+# Classifier batching: a batch is run once it has this many messages or the first message has waited this long
+CLASSIFY_BATCH_SIZE = 16
+CLASSIFY_MAX_WAIT = 0.01 # seconds
+# One of 'pytorch', 'quantized' (int8) or 'onnx' (ONNX Runtime); see compare_backends.py
+INFERENCE_BACKEND = 'pytorch'
+# Messages are truncated to this many tokens before classification
+CLASSIFY_MAX_TOKENS = 256
+# The tokenizer is saved here the first time it's loaded, so later starts don't need the network or HF cache
+TOKENIZER_PATH = 'tokenizer'
+# Auto-report messages whose P(violent) is above this
+VIOLENCE_THRESHOLD = 0.5
+# Run through the model once before live traffic, so the first real message doesn't pay for lazy initialization
+WARMUP_TEXTS = ["hi", "see you at school tomorrow", "I can't believe what happened last night " * 8]
+# Attachment OCR: number of worker processes, largest attachment we download, and download timeout
+OCR_WORKERS = 2
+OCR_MAX_BYTES = 8 * 1024 * 1024
+OCR_TIMEOUT = 10 # seconds
+OCR_MAX_FRAMES = 8 # frames sampled from animated GIF/WebP
+OCR_CACHE_PATH = 'ocr_cache.db'
+OCR_CACHE_SIZE = 10000
+INCIDENT_PREFIX_RE = re.compile(r"\*\*\[INCIDENT (\d*)\]\*\*")
+# Outbound pacing per channel, matching Discord's limit of 5 messages per 5 seconds per channel
+SEND_RATE = 1.0 # messages per second
+SEND_BURST = 5
+# Report flows with no reply for this long are dropped, and at most this many can be open at once
+REPORT_IDLE_TIMEOUT = 15 * 60 # seconds
+MAX_REPORT_SESSIONS = 1000
+# Incidents are kept here so they survive restarts
+INCIDENT_DB_PATH = 'incidents.db'
+# Fraction of messages the prefilter considers benign that are still sent to the classifier.
+# Only used once a linear stage has been trained (python prefilter.py train); the lexicon alone misses
+# too many threats, so without one every message is still classified.
+PREFILTER_SAMPLE_RATE = 0.02
+# Verdicts for previously seen message content are kept here between restarts (one file per bot process)
+VERDICT_CACHE_PATH = 'verdict_cache.json'
+VERDICT_CACHE_SIZE = 50000
+VERDICT_CACHE_TTL = 24 * 60 * 60 # seconds
+VERDICT_CACHE_SAVE_EVERY = 500 # new verdicts
+
+
+class ModBot(discord.AutoShardedClient):
+    def __init__(self, key, nlp=None, inference_sockets=None, shard_ids=None, shard_count=None):
         intents = discord.Intents.default()
-        super().__init__(command_prefix='.', intents=intents)
+        super().__init__(command_prefix='.', intents=intents, shard_ids=shard_ids, shard_count=shard_count)
         self.group_num = None
         self.mod_channels = {} # Map from guild to the mod channel id for that guild
-        self.reports = {} # Map from user IDs to the state of their report
-        self.incident_count = 0
-        self.incident_map: Dict[int, Incident] = {}
+        self.reports = ReportSessions(self, idle_timeout=REPORT_IDLE_TIMEOUT, max_sessions=MAX_REPORT_SESSIONS) # Map from user IDs to the state of their report
+        self.message_cache = MessageCache(self) # Recently fetched reported messages
+        # Other bot processes share the incident database when only some of the shards run here
+        self.incidents = IncidentStore(self, INCIDENT_DB_PATH, shared=shard_ids is not None)
+        self.opening_incident = asyncio.Lock() # held while finding or creating the incident for a report
+        self.dispatcher = Dispatcher(rate=SEND_RATE, burst=SEND_BURST)
+        # Incidents are posted to the mod channels most urgent first; later reports edit the posted summary
+        self.triage = TriageQueue(self.publish_incident)
+        self.reactions_routed = 0 # reactions matched to an incident from the mod message index
+        self.reactions_fallback = 0 # reactions that needed a fetch_message
         self.perspective_key = key
-        #Loads the model from the folder 'best_model'
-        first_model = AutoModelForSequenceClassification.from_pretrained('best_model', num_labels=2)
-        tokenizer = AutoTokenizer.from_pretrained('distilbert-base-uncased')
-        # Makes the model easy to use:
-        # Usage: nlp(string or strings to classify)
-        # Output = [{'labels': "LABEL_1", 'score': probability} for string in input]
-        # Violent Content = LABEL_1, Non-Violent = LABEL_0
-        self.nlp = pipeline("sentiment-analysis",model=first_model, tokenizer=tokenizer)
+        # The model, prefilter and OCR pool are loaded by load_models once the gateway is connecting.
+        # Channel messages that arrive before then wait on self.ready instead of being dropped.
+        # (a stand-in classifier can be passed as nlp, e.g. by replay.py)
+        # With inference_sockets, the model lives in inference_server.py processes shared by all shards instead
+        self.nlp = nlp
+        self.classifier = RemoteClassifier(inference_sockets) if inference_sockets else None
+        self.prefilter = None
+        self.ocr = None
+        self.ready = asyncio.Event()
+        # The loop only keeps weak references to tasks, so background tasks are held here
+        self.load_task = None
+        self.lag_task = None
+        self.time_to_ready = None
+        self.buffered_messages = 0 # channel messages that had to wait for load_models
+        self.verdict_cache = VerdictCache(VERDICT_CACHE_PATH, model_fingerprint('best_model') + ':' + INFERENCE_BACKEND,
+                                          max_entries=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL)
+        self.unsaved_verdicts = 0
+        self.verdict_save = None # the background save of the verdict cache, if one is running
+        self.metrics_server = None
+        Gauge('modbot_classifier_queue_depth', 'Messages waiting for the classifier',
+              lambda: self.classifier.stats()['queue_depth'] if self.classifier is not None else 0)
+        Gauge('modbot_time_to_ready_seconds', 'Seconds from process start until messages were being classified',
+              lambda: self.time_to_ready if self.time_to_ready is not None else float('nan'))
+        Gauge('modbot_buffered_messages', 'Messages that arrived while the model was loading', lambda: self.buffered_messages)
+        Gauge('modbot_outbound_queue_depth', 'Messages waiting to be sent', lambda: self.dispatcher.stats()['queued'])
+        Gauge('modbot_active_incidents', 'Incidents that are still open', lambda: len(self.incidents.active))
+        Gauge('modbot_triage_queue_depth', 'Incidents waiting to be posted or updated in the mod channels', lambda: len(self.triage))
+        Gauge('modbot_active_reports', 'User report flows in progress', lambda: len(self.reports))
+        Gauge('modbot_reactions_routed', 'Reactions matched to an incident without fetching the message', lambda: self.reactions_routed)
+        Gauge('modbot_reactions_fallback', 'Reactions that needed fetch_message', lambda: self.reactions_fallback)
+
+    async def setup_hook(self):
+        # Called after login, before the gateway connects; loading in a task lets the connection go ahead
+        self.load_task = asyncio.create_task(self.load_models())
+        # Started here rather than in on_ready: the shard that receives DMs can finish a report before on_ready
+        self.triage.start()
+
+    def load_blocking(self):
+        '''
+        The slow, import-heavy part of startup. Runs in a worker thread so the event loop keeps the gateway alive.
+        '''
+        if self.nlp is None and self.classifier is None:
+            from inference import load_engine
+            #Loads the model from the folder 'best_model'
+            # Makes the model easy to use, batching texts of similar length together:
+            # Usage: nlp(string or strings to classify)
+            # Output = [{'labels': "LABEL_1", 'score': probability} for string in input]
+            # Violent Content = LABEL_1, Non-Violent = LABEL_0
+            self.nlp = load_engine(INFERENCE_BACKEND, 'best_model', tokenizer_cache_dir=TOKENIZER_PATH,
+                                   max_length=CLASSIFY_MAX_TOKENS)
+        if self.nlp is not None:
+            self.nlp(WARMUP_TEXTS)
+        if self.prefilter is None:
+            linear = LinearStage.load()
+            self.prefilter = Prefilter(LexiconStage(load_lexicon()), linear,
+                                       sample_rate=PREFILTER_SAMPLE_RATE if linear is not None else 1.0)
+        if self.ocr is None:
+            # Only imported here (preloading the module); the pool itself (its aiohttp session, process pool
+            # and cache thread) is built on the event loop in load_models
+            importlib.import_module('handle_image')
+
+    async def load_models(self):
+        start = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.load_blocking)
+        except Exception:
+            # Without a classifier buffered messages would wait forever, so shut down instead
+            logger.exception('Could not load the classifier')
+            await self.close()
+            return
+        if self.ocr is None:
+            from handle_image import OcrPool
+            from ocr_cache import OcrCache
+            self.ocr = OcrPool(OcrCache(OCR_CACHE_PATH, max_entries=OCR_CACHE_SIZE), max_workers=OCR_WORKERS,
+                               max_bytes=OCR_MAX_BYTES, timeout=OCR_TIMEOUT, max_frames=OCR_MAX_FRAMES)
+        if self.classifier is None:
+            self.classifier = ClassificationService(self.nlp, batch_size=CLASSIFY_BATCH_SIZE, max_wait=CLASSIFY_MAX_WAIT)
+        self.classifier.start()
+        self.ready.set()
+        self.time_to_ready = time.perf_counter() - START_TIME
+        message = f'Classifier ready after {self.time_to_ready:.1f}s ({time.perf_counter() - start:.1f}s loading models), ' \
+                  f'{self.buffered_messages} messages were buffered while loading'
+        print(message)
+        logger.info(message)
 
     async def on_ready(self):
-        print(f'{self.user.name} has connected to Discord! It is these guilds:')
+        print(f'{self.user.name} has connected to Discord after {time.perf_counter() - START_TIME:.1f}s! It is these guilds:')
         for guild in self.guilds:
             print(f' - {guild.name}')
         print('Press Ctrl-C to quit.')
+        if self.metrics_server is None and METRICS_PORT is not None:
+            self.metrics_server = await start_server(METRICS_HOST, METRICS_PORT)
+            self.lag_task = asyncio.create_task(monitor_loop_lag())
 
         # Parse the group number out of the bot's name
         match = re.search('[gG]roup (\d+) [bB]ot', self.user.name)
@@ -67,6 +209,7 @@ class ModBot(discord.Client):
             for channel in guild.text_channels:
                 if channel.name == f'group-{self.group_num}-mod':
                     self.mod_channels[guild.id] = channel
+                    await self.incidents.register_mod_channel(guild.id, channel.id)
 
     async def on_message(self, message):
         '''
@@ -92,86 +235,246 @@ class ModBot(discord.Client):
             await self.handle_channel_message(after)
 
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
-        if payload.guild_id:
-            if payload.guild_id in self.mod_channels:
-                channel = self.mod_channels[payload.guild_id]
-                message: discord.Message = await channel.fetch_message(payload.message_id)
-                if message.author.id == self.user.id:
-                    # only respond to reactions on our own message in the mod channel
-                    m = re.match(r"\*\*\[INCIDENT (\d*)\]\*\*", message.content)
-                    if m is not None:
-                        i = self.incident_map[int(m.group(1))]
-                        responses = await i.handle_emoji(payload.emoji)
-                        for r in responses:
-                            await channel.send(r)
-            # only care about reactions on messages that aren't DM
+        # only care about reactions on messages in the mod channel
+        if not payload.guild_id or payload.guild_id not in self.mod_channels:
+            return
+        channel = self.mod_channels[payload.guild_id]
+        if payload.channel_id != channel.id:
+            return
+
+        # Messages we sent for an incident are indexed when sent, so most reactions route without any HTTP call
+        incident_num = await self.incidents.incident_for_mod_message(payload.message_id)
+        if incident_num is not None:
+            self.reactions_routed += 1
+        else:
+            self.reactions_fallback += 1
+            incident_num = await self.incident_from_mod_message(channel, payload.message_id)
+            if incident_num is None:
+                return
+
+        i = await self.incidents.get(incident_num)
+        if i is None:
+            return
+        responses = await i.handle_emoji(payload.emoji)
+        await self.incidents.save(i)
+        for sent in await self.dispatcher.send_all([channel], responses, coalesce_key=i.incident_num):
+            await self.incidents.add_mod_message(i.incident_num, sent.id)
+
+    async def incident_from_mod_message(self, channel: discord.TextChannel, message_id: int):
+        '''
+        Fallback for messages that aren't in the index: fetch the message and parse the incident number out of it.
+        '''
+        try:
+            message: discord.Message = await channel.fetch_message(message_id)
+        except discord.errors.NotFound:
+            return None
+        # only respond to reactions on our own message in the mod channel
+        if message.author.id != self.user.id:
+            return None
+        m = INCIDENT_PREFIX_RE.match(message.content)
+        if m is None:
+            return None
+        incident_num = int(m.group(1))
+        await self.incidents.add_mod_message(incident_num, message_id)
+        return incident_num
 
     async def handle_dm(self, message):
         # Handle a help message
         if message.content == Report.HELP_KEYWORD:
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
-            await message.channel.send(reply)
+            await self.dispatcher.send(message.channel, reply)
             return
 
         author_id = message.author.id
         responses = []
+        report = self.reports.get(author_id)
 
         # Only respond to messages if they're part of a reporting flow
-        if author_id not in self.reports and not message.content.startswith(Report.START_KEYWORD):
+        if report is None and not message.content.startswith(Report.START_KEYWORD):
+            if self.reports.was_dropped(author_id):
+                await self.dispatcher.send(message.channel, "Your report timed out. Say `report` to start again.")
             return
 
         # If we don't currently have an active report for this user, add one
-        if author_id not in self.reports:
-            self.reports[author_id] = Report(self)
+        if report is None:
+            report = self.reports.start(author_id)
 
         # Let the report class handle this message; forward all the messages it returns to uss
-        responses = await self.reports[author_id].handle_message(message)
+        responses = await report.handle_message(message)
         for r in responses:
-            await message.channel.send(r)
+            await self.dispatcher.send(message.channel, r)
 
         # If the report is complete or cancelled, remove it from our map and forward it 
         # to the mod channel
-        if self.reports[author_id].report_complete():
-            r = self.reports[author_id]
-            if r.threat_level != ThreatLevel.NOT_HARM:
-                i =  Incident(self, self.incident_count, message.author, r.message, r.threat_level) 
-                self.incident_map[self.incident_count] = i 
-                self.incident_count += 1
-                responses = await i.handle_message()
-                for mod_channel in self.mod_channels.values():
-                    for response in responses:
-                        await mod_channel.send(response)
-            self.reports.pop(author_id)
+        if report.report_complete():
+            self.reports.end(author_id)
+            if report.threat_level != ThreatLevel.NOT_HARM:
+                # Opened from the report's snapshot, so the report isn't lost if the message was deleted meanwhile;
+                # the incident fetches the live message only when moderators act on it
+                await self.open_incident(message.author, report.message, report.threat_level)
 
+    @timed('channel_message')
     async def handle_channel_message(self, message: discord.Message):
         # Only handle messages sent in the "group-#" channel
         if not message.channel.name == f'group-{self.group_num}':
             return
 
-        for attachment in message.attachments:
-            message.content += get_text_from_attachment(attachment)
+        if not self.ready.is_set():
+            self.buffered_messages += 1
+            await self.ready.wait()
+
+        # Start OCR on the attachments right away, but classify the text without waiting for it
+        ocr_task = None
+        if message.attachments:
+            ocr_task = asyncio.create_task(self.ocr.get_text_from_attachments(message.attachments))
 
         if len(message.content) > 0:
-            if self.eval_text(message):
-                i = Incident(self, self.incident_count, None, message, ThreatLevel.AUTO_REPORT)
-                self.incident_map[self.incident_count] = i
-                self.incident_count += 1
-                responses = await i.handle_message()
-                for mod_channel in self.mod_channels.values():
-                    for response in responses:
-                        await mod_channel.send(response)
+            score = await self.violence_score(message)
+            if score > VIOLENCE_THRESHOLD:
+                if ocr_task is not None:
+                    ocr_task.cancel()
+                await self.auto_report(message, score)
+                return
+
+        if ocr_task is not None:
+            attachment_text = await ocr_task
+            if len(attachment_text) > 0:
+                message.content += attachment_text
+                score = await self.violence_score(message)
+                if score > VIOLENCE_THRESHOLD:
+                    await self.auto_report(message, score)
+
+    async def auto_report(self, message: discord.Message, score: float = None):
+        await self.open_incident(None, message, ThreatLevel.AUTO_REPORT, score)
 
+    async def open_incident(self, reporter, message: Union[discord.Message, MessageSnapshot], threat_level: ThreatLevel,
+                            score: float = None):
+        '''
+        Opens an incident for the message, or adds this report to the open incident for the same message
+        (or for a copy of its content), then queues it for the mod channels.
+        '''
+        # Messages without text (e.g. only an image) are only grouped by message ID
+        content_hash = content_key(message.content) if message.content.strip() else None
+        # Looking up and creating aren't atomic any more now that they wait on the database thread,
+        # so without the lock two copies of a raid message could each open their own incident
+        async with self.opening_incident:
+            incident_num = await self.incidents.find_open(message.id, content_hash)
+            i = await self.incidents.get(incident_num) if incident_num is not None else None
+            if i is None:
+                i = await self.incidents.new_incident(reporter, message, threat_level, score, content_hash)
+            else:
+                i.add_report(reporter, threat_level, score)
+                await self.incidents.add_message(i, message)
+                await self.incidents.save_report(i)
+        self.triage.push(i)
 
-    def eval_text(self, message: discord.Message) -> bool:
+    async def publish_incident(self, i: Incident):
         '''
-        Given a message, forwards the message to our classifier and returns true if violent. 
+        Posts the incident in every mod channel the first time, and edits those posts after that
+        (until moderators have started acting on it: the posted summary asks for their first reaction).
         '''
-        return self.nlp(message.content)[0]['label'] == 'LABEL_1'
+        if i.summary_messages:
+            if i.state != ModState.AWAITING_REACT:
+                return
+            await asyncio.gather(*[self.dispatcher.edit(sent, i.summary()) for sent in i.summary_messages])
+            return
+        if i.state == ModState.FLOW_START:
+            responses = await i.handle_message()
+            await self.incidents.save(i)
+        else:
+            # Posted before a restart (or by another shard process), so there's no post here to edit
+            responses = [i.summary()]
+        i.summary_messages = await self.dispatcher.send_all(await self.all_mod_channels(), responses, coalesce_key=i.incident_num)
+        for sent in i.summary_messages:
+            await self.incidents.add_mod_message(i.incident_num, sent.id)
+
+    async def all_mod_channels(self):
+        '''
+        Mod channels in every guild. When sharded, that includes guilds handled by other shard processes
+        (sent to over REST); a single process sees every guild it's in itself.
+        '''
+        channels = list(self.mod_channels.values())
+        if self.incidents.shared:
+            for guild_id, channel_id in (await self.incidents.mod_channel_ids()).items():
+                if guild_id not in self.mod_channels:
+                    channels.append(self.get_partial_messageable(channel_id))
+        return channels
+
+    @timed('eval_text')
+    async def violence_score(self, message: discord.Message) -> float:
+        '''
+        Given a message, forwards the message to our classifier and returns the probability that it's violent.
+        The classifier batches concurrent messages together and runs off the event loop.
+        Repeated content (raids, copy-pastes, unchanged edits) is answered from the verdict cache,
+        and messages the prefilter considers obviously benign never reach the classifier.
+        '''
+        if not self.prefilter.should_classify(message.content):
+            CLASSIFICATIONS.inc('prefilter', 'LABEL_0')
+            return 0.0
+        result = self.verdict_cache.get(message.content)
+        source = 'cache'
+        if result is None:
+            source = 'model'
+            result = await self.classifier.classify(message.content)
+            self.verdict_cache.put(message.content, result)
+            self.unsaved_verdicts += 1
+            if self.unsaved_verdicts >= VERDICT_CACHE_SAVE_EVERY and (self.verdict_save is None or self.verdict_save.done()):
+                # Encoding tens of thousands of entries takes long enough to stall the loop, so write from a worker thread
+                self.verdict_save = asyncio.get_running_loop().run_in_executor(
+                    None, self.verdict_cache.save, self.verdict_cache.snapshot())
+                self.unsaved_verdicts = 0
+        CLASSIFICATIONS.inc(source, result['label'])
+        return result['score'] if result['label'] == 'LABEL_1' else 1 - result['score']
+
+    async def close(self):
+        if self.verdict_save is not None:
+            await self.verdict_save
+        self.verdict_cache.save()
+        await self.triage.stop()
+        if self.classifier is not None:
+            await self.classifier.stop()
+        if self.ocr is not None:
+            await self.ocr.close()
+        await self.incidents.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.cleanup()
+        await super().close()
 
     def code_format(self, text):
         return "```" + text + "```"
 
 
-client = ModBot(perspective_key)
-client.run(discord_token)
+if __name__ == "__main__":
+    # There should be a file called 'token.json' inside the same folder as this file
+    token_path = 'tokens.json'
+    if not os.path.isfile(token_path):
+        raise Exception(f"{token_path} not found!")
+    with open(token_path) as f:
+        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+        tokens = json.load(f)
+        discord_token = tokens['discord']
+        perspective_key = tokens['perspective']
+
+    # By default one process runs every shard and the model. For a sharded deployment see run_sharded.py
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard-ids', help="comma-separated shard IDs to run in this process")
+    parser.add_argument('--shard-count', type=int, help="total number of shards across all processes")
+    parser.add_argument('--inference-sockets', help="comma-separated inference_server.py sockets to classify with")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT)
+    parser.add_argument('--backend', default=INFERENCE_BACKEND, help="inference backend (the inference servers' one when sharded)")
+    parser.add_argument('--log-path', default=LOG_PATH)
+    parser.add_argument('--verdict-cache-path', default=VERDICT_CACHE_PATH)
+    args = parser.parse_args()
+    METRICS_PORT = args.metrics_port
+    INFERENCE_BACKEND = args.backend
+    VERDICT_CACHE_PATH = args.verdict_cache_path
+    start_logging(args.log_path)
+
+    client = ModBot(perspective_key,
+                    inference_sockets=args.inference_sockets.split(',') if args.inference_sockets else None,
+                    shard_ids=[int(s) for s in args.shard_ids.split(',')] if args.shard_ids else None,
+                    shard_count=args.shard_count)
+    # discord.py would otherwise add its own (blocking) stderr handler to the 'discord' logger and reset it to INFO
+    client.run(discord_token, log_handler=None)
+
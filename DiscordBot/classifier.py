@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger('discord')
+
+
+class ClassificationService:
+    '''
+    Collects texts to classify on an asyncio queue and runs them through the pipeline in batches.
+    A batch is sent as soon as it has `batch_size` texts or `max_wait` seconds have passed since
+    its first text arrived. The pipeline itself runs in a worker thread so the event loop
+    (and the Discord heartbeat) keeps running during the forward pass.
+    '''
+
+    def __init__(self, nlp, batch_size: int = 16, max_wait: float = 0.01):
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.worker = None
+        self.batches_run = 0
+        self.texts_classified = 0
+        self.max_batch_seen = 0
+        self.max_queue_depth = 0
+
+    def start(self):
+        # Must be called from inside the running event loop (e.g. on_ready)
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        self.executor.shutdown(wait=False)
+
+    async def classify(self, text: str) -> Dict:
+        '''
+        Queues a text and waits for its result: {'label': 'LABEL_0' or 'LABEL_1', 'score': probability}
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for text, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.nlp, texts)
+            except Exception as e:
+                logger.exception('Classification batch failed')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.batches_run += 1
+            self.texts_classified += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+    def stats(self) -> Dict:
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'max_queue_depth': self.max_queue_depth,
+            'batches_run': self.batches_run,
+            'texts_classified': self.texts_classified,
+            'mean_batch_size': self.texts_classified / self.batches_run if self.batches_run else 0.0,
+            'max_batch_size': self.max_batch_seen,
+        }
+
+
+class RemoteClassifier:
+    '''
+    Same interface as ClassificationService, but sends texts over Unix sockets to inference_server.py
+    processes instead of running the model in this process. Requests are spread round-robin over the
+    given sockets; each server batches requests from every bot process connected to it.
+    Protocol: one JSON object per line, {"id": n, "text": ...} -> {"id": n, "label": ..., "score": ...}
+    '''
+
+    def __init__(self, socket_paths: List[str]):
+        self.socket_paths = socket_paths
+        self.connections: Dict[str, Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {}
+        self.readers: Dict[str, asyncio.Task] = {}
+        self.connect_locks: Dict[str, asyncio.Lock] = {}
+        # request id -> (future for its result, socket it was sent on)
+        self.pending: Dict[int, Tuple[asyncio.Future, str]] = {}
+        self.next_id = 0
+        self.texts_classified = 0
+
+    def start(self):
+        # Connections are opened on first use
+        pass
+
+    async def stop(self):
+        for task in self.readers.values():
+            task.cancel()
+        for _, writer in self.connections.values():
+            writer.close()
+        self.connections.clear()
+        self.readers.clear()
+
+    async def _connection(self, path: str) -> asyncio.StreamWriter:
+        async with self.connect_locks.setdefault(path, asyncio.Lock()):
+            if path not in self.connections:
+                reader, writer = await asyncio.open_unix_connection(path)
+                self.connections[path] = (reader, writer)
+                self.readers[path] = asyncio.get_running_loop().create_task(self._read(path, reader))
+        return self.connections[path][1]
+
+    async def _read(self, path: str, reader: asyncio.StreamReader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future, _ = self.pending.pop(response['id'], (None, None))
+                if future is None or future.done():
+                    continue
+                if 'error' in response:
+                    future.set_exception(Exception(response['error']))
+                else:
+                    future.set_result({'label': response['label'], 'score': response['score']})
+        finally:
+            # The server went away: drop the connection so the next request reconnects
+            logger.warning(f'Lost connection to inference server at {path}')
+            self.connections.pop(path, None)
+            self.readers.pop(path, None)
+            for request_id, (future, sent_to) in list(self.pending.items()):
+                if sent_to == path and not future.done():
+                    future.set_exception(ConnectionError(f'Lost connection to inference server at {path}'))
+
+    async def classify(self, text: str) -> Dict:
+        request_id = self.next_id
+        self.next_id += 1
+        path = self.socket_paths[request_id % len(self.socket_paths)]
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, path)
+        try:
+            writer = await self._connection(path)
+            writer.write((json.dumps({'id': request_id, 'text': text}) + '\n').encode('utf-8'))
+            await writer.drain()
+            result = await future
+        finally:
+            self.pending.pop(request_id, None)
+        self.texts_classified += 1
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            'queue_depth': len(self.pending),
+            'texts_classified': self.texts_classified,
+            'connections': len(self.connections),
+        }
@@ -0,0 +1,65 @@
+# Checks that the quantized and ONNX backends agree with the fp32 model before switching INFERENCE_BACKEND in bot.py.
+# Each backend is loaded in its own process so its peak RSS can be measured separately.
+# The notebook's train/test split wasn't saved, so a sample of cs152_data.csv overlaps the training data:
+# its accuracy is only agreement with the labels, not held-out accuracy. Pass a CSV of the test split
+# with fraction 1 to measure real accuracy.
+# Usage: python compare_backends.py cs152_data.csv [sample fraction]
+import multiprocessing
+import random
+import resource
+import sys
+import time
+
+from inference import BACKENDS, load_engine
+from prefilter import read_labeled_csv
+
+
+def run_backend(backend, texts, results):
+    start = time.perf_counter()
+    nlp = load_engine(backend, 'best_model')
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    predictions = nlp(texts)
+    infer_time = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results[backend] = {'predictions': predictions, 'load_time': load_time, 'infer_time': infer_time, 'rss_mb': rss_mb}
+
+
+def sample_rows(texts, labels, fraction, seed=152):
+    rows = list(zip(texts, labels))
+    random.Random(seed).shuffle(rows)
+    rows = rows[:max(1, int(len(rows) * fraction))]
+    return [t for t, _ in rows], [l for _, l in rows]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python compare_backends.py cs152_data.csv [sample fraction]")
+        sys.exit(1)
+    fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    texts, labels = sample_rows(*read_labeled_csv(sys.argv[1]), fraction)
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Manager().dict()
+    for backend in BACKENDS:
+        p = ctx.Process(target=run_backend, args=(backend, texts, results))
+        p.start()
+        p.join()
+        if backend not in results:
+            print(f"{backend}: failed to run (is its dependency installed?)")
+
+    reference = results.get('pytorch')
+    print(f"{len(texts)} messages from {sys.argv[1]} (label agreement; only held-out accuracy if this is a test split)")
+    for backend in BACKENDS:
+        if backend not in results:
+            continue
+        r = results[backend]
+        predicted = [1 if p['label'] == 'LABEL_1' else 0 for p in r['predictions']]
+        accuracy = sum(p == l for p, l in zip(predicted, labels)) / len(labels)
+        line = f"{backend}: agreement with labels {accuracy:.4f}, load {r['load_time']:.1f}s, " \
+               f"{len(texts) / r['infer_time']:.1f} msgs/s, peak RSS {r['rss_mb']:.0f} MB"
+        if reference is not None and backend != 'pytorch':
+            agree = sum(a['label'] == b['label'] for a, b in zip(r['predictions'], reference['predictions'])) / len(texts)
+            line += f", label agreement with pytorch {agree:.4f}"
+        print(line)
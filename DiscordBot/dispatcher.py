@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import discord
+
+from metrics import timer
+
+logger = logging.getLogger('discord')
+
+# Discord rejects messages longer than this
+MAX_MESSAGE_LENGTH = 2000
+
+
+class TokenBucket:
+    '''
+    Allows `capacity` sends in a burst, refilled at `rate` sends per second.
+    '''
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Dispatcher:
+    '''
+    All outbound messages go through here. Each channel gets its own queue, paced by a token bucket
+    sized to Discord's per-channel message limit (5 per 5 seconds by default) so we don't run into 429s.
+    Queued messages that share a coalesce key (e.g. responses for the same incident) are merged into
+    one message as long as it stays under 2000 characters. DM channels are cached per user so
+    create_dm is only called once per user. Edits to messages we sent are paced by the same per-channel bucket.
+    '''
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, dm_cache_size: int = 1000):
+        self.rate = rate
+        self.burst = burst
+        self.queues: Dict[int, Deque[Tuple[str, Optional[object], asyncio.Future]]] = {}
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.dm_channels: "OrderedDict[int, discord.DMChannel]" = OrderedDict()
+        self.dm_cache_size = dm_cache_size
+        self.sent = 0
+        self.coalesced = 0
+        self.edited = 0
+
+    async def send(self, channel: discord.abc.Messageable, content: str, coalesce_key=None) -> discord.Message:
+        '''
+        Queues `content` for `channel` and waits until it has been sent. Returns the sent message,
+        which may also contain other queued messages with the same coalesce_key.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(channel.id, deque()).append((content, coalesce_key, future))
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.create_task(self._drain(channel))
+        return await future
+
+    async def send_all(self, channels: List[discord.abc.Messageable], responses: List[str], coalesce_key=None) -> List[discord.Message]:
+        '''
+        Sends every response to every channel. Channels are sent to concurrently; order within a channel is kept.
+        Returns the messages that were sent; a channel we can't send to (e.g. a guild the bot has left) is
+        logged and skipped rather than failing the sends to the other channels.
+        '''
+        results = await asyncio.gather(*[self.send(channel, response, coalesce_key)
+                                          for channel in channels for response in responses], return_exceptions=True)
+        return [r for r in results if not isinstance(r, BaseException)]
+
+    async def send_dm(self, user: discord.abc.User, content: str) -> discord.Message:
+        channel = self.dm_channels.get(user.id)
+        if channel is None:
+            channel = await user.create_dm()
+            self.dm_channels[user.id] = channel
+            while len(self.dm_channels) > self.dm_cache_size:
+                self.dm_channels.popitem(last=False)
+        self.dm_channels.move_to_end(user.id)
+        return await self.send(channel, content)
+
+    async def edit(self, message: discord.Message, content: str) -> discord.Message:
+        '''
+        Replaces the content of a message we sent, e.g. an incident summary when more reports come in.
+        '''
+        await self.buckets.setdefault(message.channel.id, TokenBucket(self.rate, self.burst)).acquire()
+        with timer('send'):
+            edited = await message.edit(content=content)
+        self.edited += 1
+        return edited
+
+    def _next_batch(self, queue: Deque) -> Tuple[str, List[asyncio.Future]]:
+        content, key, future = queue.popleft()
+        futures = [future]
+        while key is not None and queue and queue[0][1] == key \
+                and len(content) + 1 + len(queue[0][0]) <= MAX_MESSAGE_LENGTH:
+            next_content, _, next_future = queue.popleft()
+            content += "\n" + next_content
+            futures.append(next_future)
+        self.coalesced += len(futures) - 1
+        return content, futures
+
+    async def _drain(self, channel: discord.abc.Messageable):
+        queue = self.queues[channel.id]
+        bucket = self.buckets.setdefault(channel.id, TokenBucket(self.rate, self.burst))
+        try:
+            while queue:
+                await bucket.acquire()
+                content, futures = self._next_batch(queue)
+                try:
+                    with timer('send'):
+                        message = await channel.send(content)
+                except Exception as e:
+                    logger.warning(f'Could not send message to channel {channel.id}', exc_info=True)
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.sent += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            del self.workers[channel.id]
+            if not queue:
+                del self.queues[channel.id]
+
+    def stats(self) -> Dict:
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'edited': self.edited,
+            'queued': sum(len(q) for q in self.queues.values()),
+            'dm_channels_cached': len(self.dm_channels),
+        }
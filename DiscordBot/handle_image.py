@@ -1,9 +1,30 @@
-import discord
-from PIL import Image
-import requests 
+import asyncio
 import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import aiohttp
+import discord
+import numpy
+from PIL import Image, ImageFilter, ImageOps
 import pytesseract
 
+from metrics import timed
+from ocr_cache import OcrCache, distinct_frame_hashes, frames_at
+
+logger = logging.getLogger('discord')
+
+# Preprocessing before Tesseract. OCR time grows with pixel count, and text in phone screenshots
+# stays readable well below their full resolution.
+OCR_MAX_SIDE = 1600 # pixels; larger images are downscaled, smaller ones are left alone
+# Images where no tile has this fraction of edge pixels are assumed to have no text. Measured per tile rather
+# than over the whole image, so a line or two of text on a tall, otherwise empty screenshot still counts.
+OCR_EDGE_TILE = 64 # pixels
+OCR_MIN_TILE_EDGE_DENSITY = 0.02
+OCR_EDGE_THRESHOLD = 40 # grayscale edge strength that counts as an edge pixel
+OCR_CROP_MARGIN = 10 # pixels kept around the detected text region
+
 
 def is_image(attachment: discord.Attachment) -> bool:
     # see https://stackoverflow.com/questions/66858220/how-do-you-get-the-image-from-message-and-display-it-in-an-embed-discord-py
@@ -11,8 +32,159 @@ def is_image(attachment: discord.Attachment) -> bool:
         or attachment.filename.endswith(".jpeg") or attachment.filename.endswith(".png") or \
         attachment.filename.endswith(".webp") or attachment.filename.endswith(".gif")
 
-def get_text_from_attachment(attachment: discord.Attachment) -> str:
-    if is_image(attachment):
-        image = Image.open(io.BytesIO(requests.get(attachment.url).content))
-        return pytesseract.image_to_string(image)
-    return "" 
\ No newline at end of file
+def otsu_threshold(pixels: numpy.ndarray) -> int:
+    hist = numpy.bincount(pixels.ravel(), minlength=256).astype(numpy.float64)
+    weights = numpy.cumsum(hist)
+    means = numpy.cumsum(hist * numpy.arange(256))
+    total, total_mean = weights[-1], means[-1]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mean * weights - means * total) ** 2 / (weights * (total - weights))
+    return int(numpy.nanargmax(between))
+
+def max_tile_density(edges: numpy.ndarray) -> float:
+    '''
+    The largest fraction of edge pixels in any OCR_EDGE_TILE x OCR_EDGE_TILE tile (partial tiles at the border are padded).
+    '''
+    height, width = edges.shape
+    tiles_down, tiles_across = -(-height // OCR_EDGE_TILE), -(-width // OCR_EDGE_TILE)
+    padded = numpy.zeros((tiles_down * OCR_EDGE_TILE, tiles_across * OCR_EDGE_TILE), dtype=numpy.float32)
+    padded[:height, :width] = edges
+    tiles = padded.reshape(tiles_down, OCR_EDGE_TILE, tiles_across, OCR_EDGE_TILE)
+    return float(tiles.mean(axis=(1, 3)).max())
+
+def text_bounds(edges: numpy.ndarray) -> Tuple[int, int, int, int]:
+    '''
+    Bounding box (left, top, right, bottom) of the rows and columns that contain edge pixels.
+    '''
+    rows = numpy.nonzero(edges.any(axis=1))[0]
+    cols = numpy.nonzero(edges.any(axis=0))[0]
+    height, width = edges.shape
+    return (max(0, cols[0] - OCR_CROP_MARGIN), max(0, rows[0] - OCR_CROP_MARGIN),
+            min(width, cols[-1] + OCR_CROP_MARGIN + 1), min(height, rows[-1] + OCR_CROP_MARGIN + 1))
+
+def preprocess(image: Image.Image) -> Optional[Image.Image]:
+    '''
+    Downscales, converts to grayscale, crops to the region with edges and binarizes an image for Tesseract.
+    Returns None when the image has too few edges to contain text, so OCR can be skipped entirely.
+    '''
+    image = image.convert('L')
+    if max(image.size) > OCR_MAX_SIDE:
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.BILINEAR)
+    edges = numpy.asarray(image.filter(ImageFilter.FIND_EDGES)) > OCR_EDGE_THRESHOLD
+    # FIND_EDGES copies the outermost pixels unfiltered, so they say nothing about edges
+    edges[[0, -1], :] = False
+    edges[:, [0, -1]] = False
+    if max_tile_density(edges) < OCR_MIN_TILE_EDGE_DENSITY:
+        return None
+    image = image.crop(text_bounds(edges))
+    pixels = numpy.asarray(ImageOps.autocontrast(image))
+    binary = numpy.where(pixels > otsu_threshold(pixels), 255, 0).astype(numpy.uint8)
+    return Image.fromarray(binary)
+
+def image_to_text(image: Image.Image) -> str:
+    image = preprocess(image)
+    if image is None:
+        return ""
+    return pytesseract.image_to_string(image)
+
+# These run in worker processes: decoding, hashing and Tesseract are CPU-bound and would otherwise block the event loop
+def hash_image_bytes(data: bytes, max_frames: int) -> List[Tuple[int, str]]:
+    return distinct_frame_hashes(Image.open(io.BytesIO(data)), max_frames=max_frames)
+
+def ocr_image_frames(data: bytes, frame_indices: List[int]) -> List[str]:
+    frames = dict(frames_at(Image.open(io.BytesIO(data)), frame_indices))
+    try:
+        return [image_to_text(frames[index]) for index in frame_indices]
+    except Exception as e:
+        # Some pytesseract errors can't be unpickled in the parent, which would break the pool for good
+        raise Exception(f'{type(e).__name__}: {e}') from None
+
+
+class OcrPool:
+    '''
+    Downloads attachments with a shared aiohttp session and OCRs them in a process pool.
+    At most `max_workers` images are decoded/OCR'd at once; attachments over `max_bytes`
+    or downloads slower than `timeout` seconds are skipped.
+    Results are cached by attachment ID, exact bytes and perceptual hash, so reposts (even
+    re-encoded ones of the same size) skip Tesseract. Animated GIF/WebP are sampled at up to `max_frames` frames,
+    and only frames that look different from each other are OCR'd.
+    '''
+
+    def __init__(self, cache: OcrCache, max_workers: int = 2, max_bytes: int = 8 * 1024 * 1024, timeout: float = 10,
+                 max_frames: int = 8):
+        self.cache = cache
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.session: aiohttp.ClientSession = None
+
+    async def download(self, attachment: discord.Attachment) -> bytes:
+        if attachment.size > self.max_bytes:
+            logger.info(f'Skipping attachment {attachment.filename}: {attachment.size} bytes is over the limit')
+            return None
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        try:
+            async with self.session.get(attachment.url) as response:
+                response.raise_for_status()
+                if response.content_length is not None and response.content_length > self.max_bytes:
+                    logger.info(f'Skipping attachment {attachment.filename}: {response.content_length} bytes is over the limit')
+                    return None
+                # content.read(n) only returns what has arrived so far, so collect chunks until the body ends
+                data = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    data += chunk
+                    if len(data) > self.max_bytes:
+                        logger.info(f'Skipping attachment {attachment.filename}: body is over the limit')
+                        return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.warning(f'Could not download attachment {attachment.filename}', exc_info=True)
+            return None
+        return bytes(data)
+
+    @timed('ocr')
+    async def get_text_from_attachment(self, attachment: discord.Attachment) -> str:
+        if not is_image(attachment):
+            return ""
+        text = await self.cache.get_attachment(attachment.id)
+        if text is not None:
+            return text
+        data = await self.download(attachment)
+        if data is None:
+            return ""
+        sha = await self.cache.digest(data)
+        text = await self.cache.get_bytes(sha)
+        if text is None:
+            try:
+                text = await self.ocr(data)
+            except Exception:
+                logger.warning(f'Could not OCR attachment {attachment.filename}', exc_info=True)
+                return ""
+        await self.cache.put(attachment.id, sha, text)
+        return text
+
+    async def ocr(self, data: bytes) -> str:
+        loop = asyncio.get_running_loop()
+        frame_hashes = await loop.run_in_executor(self.executor, hash_image_bytes, data, self.max_frames)
+        texts = {index: await self.cache.get_phash(key) for index, key in frame_hashes}
+        missing = [index for index, text in texts.items() if text is None]
+        if missing:
+            ocr_texts = await loop.run_in_executor(self.executor, ocr_image_frames, data, missing)
+            for index, text in zip(missing, ocr_texts):
+                texts[index] = text
+            for index, key in frame_hashes:
+                if index in missing:
+                    await self.cache.put_phash(key, texts[index])
+        return "".join(texts[index] for index, _ in frame_hashes)
+
+    async def get_text_from_attachments(self, attachments: List[discord.Attachment]) -> str:
+        texts = await asyncio.gather(*[self.get_text_from_attachment(a) for a in attachments])
+        return "".join(texts)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.executor.shutdown(wait=False)
+        await self.cache.close()
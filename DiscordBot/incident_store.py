@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+
+import discord
+
+from mod_flow import Incident, ModState
+from report import MessageSnapshot, ThreatLevel
+
+logger = logging.getLogger('discord')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS incidents (
+    incident_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    threat_level TEXT NOT NULL,
+    reporter_id INTEGER,
+    author_id INTEGER NOT NULL,
+    author_name TEXT,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    content_hash TEXT,
+    reporter_count INTEGER NOT NULL DEFAULT 1,
+    user_reports INTEGER NOT NULL DEFAULT 0,
+    score REAL
+);
+CREATE INDEX IF NOT EXISTS incidents_author ON incidents (author_id);
+CREATE TABLE IF NOT EXISTS incident_messages (
+    incident_id INTEGER NOT NULL REFERENCES incidents (incident_id),
+    message_id INTEGER NOT NULL,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    author_name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (incident_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS incident_messages_message ON incident_messages (message_id);
+CREATE TABLE IF NOT EXISTS mod_messages (
+    mod_message_id INTEGER PRIMARY KEY,
+    incident_id INTEGER NOT NULL REFERENCES incidents (incident_id)
+);
+CREATE INDEX IF NOT EXISTS mod_messages_incident ON mod_messages (incident_id);
+CREATE TABLE IF NOT EXISTS transitions (
+    incident_id INTEGER NOT NULL REFERENCES incidents (incident_id),
+    from_state TEXT NOT NULL,
+    to_state TEXT NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_incident ON transitions (incident_id);
+CREATE TABLE IF NOT EXISTS mod_channels (
+    guild_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL
+);
+'''
+
+# Columns added since the first schema, so databases created before them can be upgraded in place
+ADDED_COLUMNS = {
+    'author_name': 'TEXT',
+    'content_hash': 'TEXT',
+    'reporter_count': 'INTEGER NOT NULL DEFAULT 1',
+    'user_reports': 'INTEGER NOT NULL DEFAULT 0',
+    'score': 'REAL',
+}
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS incidents_message ON incidents (message_id);
+CREATE INDEX IF NOT EXISTS incidents_content_hash ON incidents (content_hash);
+'''
+
+
+class IncidentStore:
+    '''
+    Keeps incidents in SQLite so they survive restarts. Only incidents that are still open are held in
+    memory; an incident is dropped from memory once it reaches REPORT_COMPLETE and is reloaded from the
+    database if it is needed again. The reported message's content is stored too, so reloading never
+    needs the message itself (which moderation has usually deleted by then).
+    Incident IDs come from an AUTOINCREMENT key, so they keep increasing across restarts.
+    Reports of a message that already has an open incident are grouped into it: find_open looks incidents up
+    by offending message ID or by a hash of its content (so copy-pastes of the same message group too).
+    Every grouped message is kept in incident_messages, so moderation deletes every copy and reaches every author.
+    With `shared` set, several bot processes use the same database: cached incidents re-read their
+    state before use, since another process may have handled a reaction on them.
+    SQLite runs on one worker thread (which owns the connection), so queries, commits and waiting on another
+    process's write lock never block the event loop. Writes are queued in order on that thread.
+    '''
+
+    def __init__(self, client, path: str, mod_message_cache_size: int = 10000, shared: bool = False):
+        self.client = client
+        self.shared = shared
+        # Mod-channel message ID -> incident ID for recently sent messages, so reactions route without a query
+        self.mod_messages: "OrderedDict[int, int]" = OrderedDict()
+        self.mod_message_cache_size = mod_message_cache_size
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.db: sqlite3.Connection = None
+        # Opened on the worker thread, since a connection can only be used from the thread that made it
+        self.executor.submit(self._open, path).result()
+        self.active: Dict[int, Incident] = {}
+        self.saved_states: Dict[int, ModState] = {}
+
+    # These run on the worker thread
+    def _open(self, path: str):
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # Safe with WAL (a crash can lose the last commits, not corrupt the file) and avoids an fsync per commit
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(incidents)')}
+        for column, definition in ADDED_COLUMNS.items():
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE incidents ADD COLUMN {column} {definition}')
+        self.db.executescript(INDEXES)
+        self.db.commit()
+
+    def _fetch_one(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        return self.db.execute(sql, params).fetchone()
+
+    def _fetch_all(self, sql: str, params: tuple = ()) -> List[tuple]:
+        return self.db.execute(sql, params).fetchall()
+
+    def _write(self, *statements) -> int:
+        '''
+        Runs (sql, params) statements in one transaction; returns the last inserted row ID.
+        '''
+        cursor = None
+        for sql, params in statements:
+            cursor = self.db.execute(sql, params)
+        self.db.commit()
+        return cursor.lastrowid
+
+    def _insert_incident(self, incident_values: tuple, message: MessageSnapshot) -> int:
+        cursor = self.db.execute(
+            'INSERT INTO incidents (state, threat_level, reporter_id, author_id, author_name, guild_id, channel_id, message_id, '
+            'content, created, content_hash, score, user_reports) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            incident_values)
+        self.db.execute(*self._insert_message(cursor.lastrowid, message))
+        self.db.commit()
+        return cursor.lastrowid
+
+    def _close(self):
+        self.db.close()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def new_incident(self, reporter, offending_message: Union[discord.Message, MessageSnapshot],
+                           threat_level: ThreatLevel, score: float = None, content_hash: str = None) -> Incident:
+        '''
+        Opens an incident for a live message, or for a report's snapshot (the message may be gone by then).
+        '''
+        message = MessageSnapshot.of(offending_message)
+        live = offending_message if offending_message is not message else None
+        incident_num = await self._run(self._insert_incident, (
+            ModState.FLOW_START.name, threat_level.name, reporter.id if reporter is not None else None,
+            message.author_id, message.author_name, message.guild_id, message.channel_id, message.id, message.content,
+            time.time(), content_hash, score, 1 if reporter is not None else 0), message)
+        i = Incident(self.client, incident_num, reporter, message, threat_level, score, live)
+        self.active[i.incident_num] = i
+        self.saved_states[i.incident_num] = i.state
+        return i
+
+    @staticmethod
+    def _insert_message(incident_num: int, message: MessageSnapshot):
+        return ('INSERT OR IGNORE INTO incident_messages (incident_id, message_id, guild_id, channel_id, author_id, '
+                'author_name, content) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (incident_num, message.id, message.guild_id, message.channel_id, message.author_id,
+                 message.author_name, message.content))
+
+    async def _load_messages(self, incident: Incident):
+        for row in await self._run(self._fetch_all, 'SELECT message_id, guild_id, channel_id, author_id, author_name, content '
+                                   'FROM incident_messages WHERE incident_id = ? ORDER BY rowid', (incident.incident_num,)):
+            incident.add_message(MessageSnapshot(*row))
+
+    async def _user(self, user_id: Optional[int]):
+        if user_id is None:
+            return None
+        try:
+            return self.client.get_user(user_id) or await self.client.fetch_user(user_id)
+        except discord.errors.HTTPException:
+            return None
+
+    async def get(self, incident_num: int) -> Optional[Incident]:
+        if incident_num in self.active:
+            i = self.active[incident_num]
+            if self.shared:
+                row = await self._run(self._fetch_one, 'SELECT state, threat_level, reporter_count, score, user_reports '
+                                      'FROM incidents WHERE incident_id = ?', (incident_num,))
+                i.state = ModState[row[0]]
+                i.threat_level, i.report_count, i.score, i.user_reports = ThreatLevel[row[1]], row[2], row[3], row[4]
+                await self._load_messages(i)
+                # The other process already recorded this state and its transition
+                self.saved_states[incident_num] = i.state
+                if i.state == ModState.REPORT_COMPLETE:
+                    self.active.pop(incident_num, None)
+                    self.saved_states.pop(incident_num, None)
+            return i
+        row = await self._run(self._fetch_one, 'SELECT state, threat_level, reporter_id, message_id, guild_id, channel_id, '
+                              'author_id, author_name, content, reporter_count, score, user_reports FROM incidents '
+                              'WHERE incident_id = ?', (incident_num,))
+        if row is None:
+            return None
+        (state, threat_level, reporter_id, message_id, guild_id, channel_id, author_id, author_name, content,
+         reporter_count, score, user_reports) = row
+        # Incidents stored before author names were kept fall back to the ID
+        message = MessageSnapshot(message_id, guild_id, channel_id, author_id, author_name or str(author_id), content)
+        i = Incident(self.client, incident_num, await self._user(reporter_id), message, ThreatLevel[threat_level], score)
+        await self._load_messages(i)
+        if incident_num in self.active:
+            # Loaded by another handler while this one was waiting on the database
+            return self.active[incident_num]
+        i.state = ModState[state]
+        i.report_count = reporter_count
+        # Incidents stored before user reports were counted separately had at most the first reporter's
+        i.user_reports = max(user_reports, 1 if reporter_id is not None else 0)
+        self.saved_states[incident_num] = i.state
+        if i.state != ModState.REPORT_COMPLETE:
+            self.active[incident_num] = i
+        return i
+
+    async def save(self, incident: Incident):
+        '''
+        Records the incident's current state (and the transition that led there, if it changed).
+        '''
+        previous = self.saved_states.get(incident.incident_num)
+        if incident.state == ModState.REPORT_COMPLETE:
+            self.active.pop(incident.incident_num, None)
+            self.saved_states.pop(incident.incident_num, None)
+        else:
+            self.saved_states[incident.incident_num] = incident.state
+        if previous != incident.state:
+            await self._run(self._write,
+                            ('UPDATE incidents SET state = ? WHERE incident_id = ?', (incident.state.name, incident.incident_num)),
+                            ('INSERT INTO transitions (incident_id, from_state, to_state, time) VALUES (?, ?, ?, ?)',
+                             (incident.incident_num, previous.name if previous else '', incident.state.name, time.time())))
+
+    async def find_open(self, message_id: int, content_hash: str = None) -> Optional[int]:
+        '''
+        The newest incident that isn't complete yet for this message, or for another message with the same content.
+        '''
+        row = await self._run(self._fetch_one, 'SELECT MAX(incident_id) FROM incidents WHERE state != ? AND (message_id = ? '
+                              'OR content_hash = ? OR incident_id IN (SELECT incident_id FROM incident_messages WHERE message_id = ?))',
+                              (ModState.REPORT_COMPLETE.name, message_id, content_hash, message_id))
+        return row[0]
+
+    async def add_message(self, incident: Incident, message: Union[discord.Message, MessageSnapshot]):
+        '''
+        Groups a copy of the reported message into the incident, so actions on the incident apply to it too.
+        '''
+        snapshot = MessageSnapshot.of(message)
+        if incident.add_message(snapshot, message if message is not snapshot else None):
+            await self._run(self._write, self._insert_message(incident.incident_num, snapshot))
+
+    async def save_report(self, incident: Incident):
+        '''
+        Records another report grouped into an existing incident: its count, threat level and score if they went up,
+        and the reporter if this is the first user report of something the classifier found.
+        '''
+        await self._run(self._write, (
+            'UPDATE incidents SET threat_level = ?, reporter_count = ?, user_reports = ?, score = ?, '
+            'reporter_id = COALESCE(reporter_id, ?) WHERE incident_id = ?',
+            (incident.threat_level.name, incident.report_count, incident.user_reports, incident.score,
+             incident.reporter.id if incident.reporter is not None else None, incident.incident_num)))
+
+    def _remember_mod_message(self, mod_message_id: int, incident_num: int):
+        self.mod_messages[mod_message_id] = incident_num
+        self.mod_messages.move_to_end(mod_message_id)
+        while len(self.mod_messages) > self.mod_message_cache_size:
+            self.mod_messages.popitem(last=False)
+
+    async def add_mod_message(self, incident_num: int, mod_message_id: int):
+        self._remember_mod_message(mod_message_id, incident_num)
+        await self._run(self._write, ('INSERT OR REPLACE INTO mod_messages (mod_message_id, incident_id) VALUES (?, ?)',
+                                      (mod_message_id, incident_num)))
+
+    async def incident_for_mod_message(self, mod_message_id: int) -> Optional[int]:
+        if mod_message_id in self.mod_messages:
+            self.mod_messages.move_to_end(mod_message_id)
+            return self.mod_messages[mod_message_id]
+        row = await self._run(self._fetch_one, 'SELECT incident_id FROM mod_messages WHERE mod_message_id = ?', (mod_message_id,))
+        if row is None:
+            return None
+        self._remember_mod_message(mod_message_id, row[0])
+        return row[0]
+
+    async def register_mod_channel(self, guild_id: int, channel_id: int):
+        await self._run(self._write, ('INSERT OR REPLACE INTO mod_channels (guild_id, channel_id) VALUES (?, ?)',
+                                      (guild_id, channel_id)))
+
+    async def mod_channel_ids(self) -> Dict[int, int]:
+        '''
+        Guild ID -> mod channel ID for every guild any bot process has seen.
+        '''
+        return dict(await self._run(self._fetch_all, 'SELECT guild_id, channel_id FROM mod_channels'))
+
+    async def incidents_by_author(self, author_id: int) -> List[int]:
+        return [row[0] for row in await self._run(self._fetch_all, 'SELECT incident_id FROM incidents WHERE author_id = ? '
+                                                  'ORDER BY incident_id', (author_id,))]
+
+    async def close(self):
+        await self._run(self._close)
+        self.executor.shutdown(wait=False)
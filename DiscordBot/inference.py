@@ -0,0 +1,180 @@
+import os
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+
+import torch
+
+from metrics import timer
+
+BACKENDS = ['pytorch', 'quantized', 'onnx']
+
+
+class InferenceEngine:
+    '''
+    Runs the best_model checkpoint over lists of texts, grouping them into length buckets so each
+    batch is only padded to the longest text in its bucket instead of the longest text overall.
+    Callable the same way as the HF pipeline:
+    Usage: engine(list of strings to classify)
+    Output = [{'label': "LABEL_1", 'score': probability} for string in input]
+    '''
+
+    def __init__(self, model, tokenizer, max_length: int = 256, bucket_edges: Sequence[int] = (16, 32, 64, 128),
+                 max_batch_size: int = 32, short_text_chars: int = 32, short_cache_size: int = 4096):
+        self.model = model
+        if model is not None:
+            self.model.eval()
+            self.id2label = model.config.id2label
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        # Any text longer than the last edge falls in a final bucket capped by max_length
+        self.bucket_edges = sorted(e for e in bucket_edges if e < max_length) + [max_length]
+        self.max_batch_size = max_batch_size
+        # Short messages ("lol", "gg") repeat constantly, so their token ids are memoized
+        self.short_text_chars = short_text_chars
+        self.short_cache_size = short_cache_size
+        self.short_cache: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.tokens_processed = 0
+
+    def encode(self, text: str) -> List[int]:
+        if len(text) <= self.short_text_chars:
+            ids = self.short_cache.get(text)
+            if ids is not None:
+                self.short_cache.move_to_end(text)
+                return ids
+        ids = self.tokenizer(text, truncation=True, max_length=self.max_length)['input_ids']
+        if len(text) <= self.short_text_chars:
+            self.short_cache[text] = ids
+            if len(self.short_cache) > self.short_cache_size:
+                self.short_cache.popitem(last=False)
+        return ids
+
+    def bucket_of(self, length: int) -> int:
+        for i, edge in enumerate(self.bucket_edges):
+            if length <= edge:
+                return i
+        return len(self.bucket_edges) - 1
+
+    def batches(self, encoded: List[List[int]]) -> List[List[int]]:
+        '''
+        Returns lists of indices into `encoded`; each list is one batch from a single length bucket.
+        '''
+        buckets: Dict[int, List[int]] = {}
+        for i in sorted(range(len(encoded)), key=lambda i: len(encoded[i])):
+            buckets.setdefault(self.bucket_of(len(encoded[i])), []).append(i)
+        batches = []
+        for bucket in sorted(buckets):
+            indices = buckets[bucket]
+            for start in range(0, len(indices), self.max_batch_size):
+                batches.append(indices[start:start + self.max_batch_size])
+        return batches
+
+    def __call__(self, texts) -> List[Dict]:
+        if isinstance(texts, str):
+            texts = [texts]
+        with timer('tokenize'):
+            encoded = [self.encode(text) for text in texts]
+        results: List[Dict] = [None] * len(texts)
+        with torch.no_grad():
+            for batch in self.batches(encoded):
+                inputs = self.tokenizer.pad({'input_ids': [encoded[i] for i in batch]}, padding='longest', return_tensors='pt')
+                self.tokens_processed += int(inputs['attention_mask'].sum())
+                with timer('inference'):
+                    logits = self.logits(inputs)
+                probs = torch.softmax(logits, dim=-1)
+                scores, labels = probs.max(dim=-1)
+                for i, score, label in zip(batch, scores.tolist(), labels.tolist()):
+                    results[i] = {'label': self.id2label[label], 'score': score}
+        return results
+
+    def logits(self, inputs) -> torch.Tensor:
+        return self.model(**inputs).logits
+
+
+class OnnxInferenceEngine(InferenceEngine):
+    '''
+    Same bucketing as InferenceEngine, but the forward pass runs in ONNX Runtime on the CPU.
+    '''
+
+    def __init__(self, session, id2label: Dict[int, str], tokenizer, **kwargs):
+        super().__init__(None, tokenizer, **kwargs)
+        self.session = session
+        self.id2label = id2label
+
+    def logits(self, inputs) -> torch.Tensor:
+        outputs = self.session.run(['logits'], {
+            'input_ids': inputs['input_ids'].numpy(),
+            'attention_mask': inputs['attention_mask'].numpy(),
+        })
+        return torch.from_numpy(outputs[0])
+
+
+def export_onnx(model, onnx_path: str):
+    model.eval()
+    dummy = {'input_ids': torch.ones(1, 8, dtype=torch.long), 'attention_mask': torch.ones(1, 8, dtype=torch.long)}
+    dynamic = {0: 'batch', 1: 'sequence'}
+    torch.onnx.export(model, (dummy['input_ids'], dummy['attention_mask']), onnx_path,
+                      input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                      dynamic_axes={'input_ids': dynamic, 'attention_mask': dynamic, 'logits': {0: 'batch'}},
+                      opset_version=14)
+
+
+def has_tokenizer(directory: str) -> bool:
+    return directory is not None and os.path.isfile(os.path.join(directory, 'tokenizer_config.json'))
+
+
+def load_tokenizer(tokenizer_name: str, cache_dir: str = None, model_dir: str = None):
+    '''
+    Loads the tokenizer bundled with the checkpoint in model_dir (see `python inference.py bundle-tokenizer`),
+    else the copy saved in cache_dir, else from tokenizer_name (which may need the network or the HF cache)
+    and then saves it to cache_dir for next time.
+    '''
+    from transformers import AutoTokenizer
+    for directory in (model_dir, cache_dir):
+        if has_tokenizer(directory):
+            return AutoTokenizer.from_pretrained(directory, local_files_only=True)
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    if cache_dir is not None:
+        tokenizer.save_pretrained(cache_dir)
+    return tokenizer
+
+
+def load_engine(backend: str = 'pytorch', model_dir: str = 'best_model', tokenizer_name: str = 'distilbert-base-uncased',
+                tokenizer_cache_dir: str = None, **kwargs) -> InferenceEngine:
+    '''
+    Loads best_model with the chosen backend. All backends return the same labels (LABEL_1 = violent).
+      pytorch:   the fp32 checkpoint as trained
+      quantized: Linear layers dynamically quantized to int8
+      onnx:      exported to <model_dir>/model.onnx (again whenever the weights change) and run with ONNX Runtime
+    '''
+    from transformers import AutoModelForSequenceClassification
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown inference backend {backend}, should be one of {', '.join(BACKENDS)}")
+    tokenizer = load_tokenizer(tokenizer_name, tokenizer_cache_dir, model_dir)
+
+    if backend == 'onnx':
+        import onnxruntime
+        from transformers import AutoConfig
+        onnx_path = os.path.join(model_dir, 'model.onnx')
+        weights_path = os.path.join(model_dir, 'pytorch_model.bin')
+        if not os.path.isfile(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(weights_path):
+            export_onnx(AutoModelForSequenceClassification.from_pretrained(model_dir, num_labels=2), onnx_path)
+        session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        config = AutoConfig.from_pretrained(model_dir)
+        return OnnxInferenceEngine(session, config.id2label, tokenizer, **kwargs)
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir, num_labels=2)
+    if backend == 'quantized':
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return InferenceEngine(model, tokenizer, **kwargs)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'bundle-tokenizer':
+        print("Usage: python inference.py bundle-tokenizer [model dir]")
+        sys.exit(1)
+    # Saves the tokenizer next to the checkpoint, so the bot starts without the network or the HF cache
+    model_dir = sys.argv[2] if len(sys.argv) == 3 else 'best_model'
+    from transformers import AutoTokenizer
+    AutoTokenizer.from_pretrained('distilbert-base-uncased').save_pretrained(model_dir)
+    print(f"Saved the tokenizer to {model_dir}")
@@ -0,0 +1,59 @@
+# Holds one copy of best_model and classifies texts for every bot process connected to its Unix socket.
+# Requests from all connections go through one ClassificationService, so they are batched together.
+# Usage: python inference_server.py /tmp/modbot-inference-0.sock [backend]
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from classifier import ClassificationService
+from inference import load_engine
+
+logger = logging.getLogger('discord')
+
+BATCH_SIZE = 32
+MAX_WAIT = 0.01 # seconds
+MAX_TOKENS = 256
+
+
+async def handle_connection(service: ClassificationService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    async def answer(request):
+        try:
+            result = await service.classify(request['text'])
+            response = {'id': request['id'], 'label': result['label'], 'score': result['score']}
+        except Exception as e:
+            response = {'id': request['id'], 'error': str(e)}
+        writer.write((json.dumps(response) + '\n').encode('utf-8'))
+
+    # Answer requests concurrently so they can share a batch; responses may come back out of order
+    tasks = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        task = asyncio.create_task(answer(json.loads(line)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    writer.close()
+
+
+async def serve(socket_path: str, backend: str):
+    nlp = load_engine(backend, 'best_model', tokenizer_cache_dir='tokenizer', max_length=MAX_TOKENS)
+    service = ClassificationService(nlp, batch_size=BATCH_SIZE, max_wait=MAX_WAIT)
+    service.start()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(lambda r, w: handle_connection(service, r, w), path=socket_path)
+    print(f'Inference server ({backend}) listening on {socket_path}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python inference_server.py <socket path> [pytorch|quantized|onnx]")
+        sys.exit(1)
+    asyncio.run(serve(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'pytorch'))
@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> (count per bucket, total count, sum)
+        self.values: Dict[Tuple, List] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        entry = self.values.setdefault(labels, [[0] * len(self.buckets), 0, 0.0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, value_sum) in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(self.label_names + ("le",), labels + (bound,))} {count}')
+            lines.append(f'{self.name}_bucket{_labels(self.label_names + ("le",), labels + ("+Inf",))} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {value_sum}')
+        return lines
+
+
+class Gauge:
+    '''
+    Read from `fn` whenever the endpoint is scraped, e.g. the current length of a queue.
+    '''
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {self.fn()}']
+
+
+REGISTRY: List = []
+
+STAGE_SECONDS = Histogram('modbot_stage_seconds', 'Time spent in each processing stage', ['stage'])
+LOOP_LAG_SECONDS = Histogram('modbot_event_loop_lag_seconds', 'How late the event loop wakes up a sleeping task')
+CLASSIFICATIONS = Counter('modbot_classifications_total', 'Messages classified, by where the verdict came from and what it was',
+                          ['source', 'verdict'])
+
+
+@contextmanager
+def timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def timed(stage: str):
+    '''
+    Decorator recording how long each call of a coroutine function takes under `stage`.
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timer(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(interval: float = 0.25):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def start_server(host: str, port: int) -> 'web.AppRunner':
+    '''
+    Serves all metrics in the Prometheus text format at http://host:port/metrics
+    '''
+    # Imported here so tools that only time things (e.g. violence_classifier.py) don't need aiohttp
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
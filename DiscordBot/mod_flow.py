@@ -2,7 +2,10 @@ from enum import Enum, auto
 import discord
 import emoji
 
-from report import ThreatLevel
+from metrics import timed
+from typing import Dict, List, Optional
+
+from report import MessageSnapshot, ThreatLevel
 
 class ModState(Enum):
     FLOW_START = auto()
@@ -24,33 +27,110 @@ react_state_update = {
     (':thumbs_down:', ModState.ASK_IF_SHOULD_BAN) : ModState.REPORT_COMPLETE
 }
 
+# Higher is more urgent when triaging incidents
+threat_rank = {
+    ThreatLevel.IMMINENT: 3,
+    ThreatLevel.NON_IMMINENT: 2,
+    ThreatLevel.AUTO_REPORT: 1,
+    ThreatLevel.NOT_HARM: 0,
+}
+
 class Incident:
-    def __init__(self, client, incident_num, reporter, offending_message: discord.Message, threat_level: ThreatLevel):
+    def __init__(self, client, incident_num, reporter, message: MessageSnapshot, threat_level: ThreatLevel,
+                 score: float = None, offending_message: discord.Message = None):
         self.state = ModState.FLOW_START
+        self.incident_num = incident_num
         self.reporter = reporter
         self.incident_prefix = f"**[INCIDENT {incident_num}]**\n"
         self.client = client
-        self.offending_message = offending_message
+        self.message = message # what was reported, as stored with the incident
+        # Every message grouped into this incident (e.g. copies posted by raid accounts), first one first
+        self.messages: List[MessageSnapshot] = [message]
+        # message ID -> the live message (None once deleted), only fetched when an action needs it
+        self.live_messages: Dict[int, Optional[discord.Message]] = {}
+        if offending_message is not None:
+            self.live_messages[message.id] = offending_message
         self.threat_level = threat_level 
-    
-    async def handle_message(self):
-        assert self.state == ModState.FLOW_START
+        self.score = score # classifier's P(violent), if it has looked at this message
+        self.report_count = 1 # user reports and classifier detections grouped into this incident
+        self.user_reports = 1 if reporter is not None else 0 # just the user reports among them
+        self.summary_messages = [] # the messages posted in mod channels for this incident, edited as reports come in
+
+    def add_report(self, reporter, threat_level: ThreatLevel, score: float = None):
+        '''
+        Groups another report or detection of the same message into this incident.
+        '''
+        self.report_count += 1
+        if reporter is not None:
+            self.user_reports += 1
+        if self.reporter is None:
+            self.reporter = reporter
+        if threat_rank[threat_level] > threat_rank[self.threat_level]:
+            self.threat_level = threat_level
+        if score is not None:
+            self.score = max(score, self.score or 0.0)
+
+    def add_message(self, message: MessageSnapshot, live: discord.Message = None) -> bool:
+        '''
+        Adds a copy of the reported message to the incident, so moderation acts on it too. False if it's already here.
+        '''
+        if any(m.id == message.id for m in self.messages):
+            return False
+        self.messages.append(message)
+        if live is not None:
+            self.live_messages[message.id] = live
+        return True
+
+    def authors(self) -> List[MessageSnapshot]:
+        '''
+        The first grouped message from each distinct author.
+        '''
+        seen = {}
+        for m in self.messages:
+            seen.setdefault(m.author_id, m)
+        return list(seen.values())
+
+    def priority(self):
+        '''
+        Sort key for triage; smaller is more urgent. Threat level first, then classifier score, then report volume.
+        '''
+        return (-threat_rank[self.threat_level], -(self.score or 0.0), -self.report_count)
+
+    def summary(self):
         forward_message = self.incident_prefix
 
-        if self.reporter is not None:
-            forward_message += self.reporter.name 
+        detections = self.report_count - self.user_reports
+        if self.user_reports > 0:
+            # The reporter may not be known any more if their account couldn't be fetched after a restart
+            forward_message += self.reporter.name if self.reporter is not None else 'A user'
+            if self.user_reports > 1:
+                forward_message += f" and {self.user_reports - 1} other user(s)"
+            if detections > 0:
+                forward_message += f" (and our classifier, {detections} detection(s))"
         else:
             forward_message += 'Our classifier '
+            if detections > 1:
+                forward_message += f"({detections} detections)"
 
         forward_message += " reported this message as possibly containing violence:\n" 
-        forward_message += "```" + self.offending_message.author.name + ": " + self.offending_message.content + "```\n"
+        forward_message += "```" + self.message.author_name + ": " + self.message.content + "```\n"
+        if len(self.messages) > 1:
+            forward_message += f"Posted {len(self.messages)} times by {len(self.authors())} account(s); actions apply to every copy.\n"
         if self.threat_level != ThreatLevel.AUTO_REPORT:
             forward_message += "They rated the treat level as "
             forward_message += "**not imminent**\n" if self.threat_level == ThreatLevel.NON_IMMINENT else "**imminent**\n"
+        if self.score is not None:
+            forward_message += f"Classifier score: {self.score:.2f}\n"
         forward_message += "React with :thumbsdown: if the message is not a threat, :exclamation: if it is a threat but *not* imminent, and :bangbang: if it *is* imminent"
+        return forward_message
+
+    @timed('incident_message')
+    async def handle_message(self):
+        assert self.state == ModState.FLOW_START
         self.state = ModState.AWAITING_REACT
-        return [forward_message]
+        return [self.summary()]
 
+    @timed('incident_emoji')
     async def handle_emoji(self, react_emoji: discord.PartialEmoji):
         react = emoji.demojize(react_emoji.name)
         if self.state == ModState.AWAITING_REACT:
@@ -105,27 +185,51 @@ class Incident:
             
         return []
 
+    async def get_offending_message(self, message: MessageSnapshot) -> Optional[discord.Message]:
+        '''
+        The live message, or None if it has been deleted since it was reported.
+        '''
+        if message.id not in self.live_messages:
+            self.live_messages[message.id] = await self.client.message_cache.resolve(message)
+        return self.live_messages[message.id]
+
+    async def get_author(self, message: MessageSnapshot) -> discord.abc.User:
+        live = await self.get_offending_message(message)
+        if live is not None:
+            return live.author
+        return self.client.get_user(message.author_id) or await self.client.fetch_user(message.author_id)
+
+    def mention_authors(self) -> str:
+        return ', '.join(f'@{m.author_name}' for m in self.authors())
+
     async def delete_message(self, send_message=True):
         if send_message:
-            msg = "Our moderators believe that the below message violates our policies against promoting or glorifying violence:"
-            msg += "```" + self.offending_message.author.name + ": " + self.offending_message.content + "```\n"
-            msg += "We are therefore removing it from the platform."
-            channel = await self.offending_message.author.create_dm()
-            await channel.send(msg)
-        await self.offending_message.delete()
+            for m in self.authors():
+                msg = "Our moderators believe that the below message violates our policies against promoting or glorifying violence:"
+                msg += "```" + m.author_name + ": " + m.content + "```\n"
+                msg += "We are therefore removing it from the platform."
+                await self.client.dispatcher.send_dm(await self.get_author(m), msg)
+        for m in self.messages:
+            live = await self.get_offending_message(m)
+            if live is not None:
+                try:
+                    await live.delete()
+                except discord.errors.NotFound:
+                    pass
+                self.live_messages[m.id] = None
 
     async def ban_user(self):
-        msg = "Our moderators believe that this message violates our policies around threatening, promoting, or glorifying violence"
-        msg += "```" + self.offending_message.author.name + ": " + self.offending_message.content + "```\n"
-        msg += "We are therefore banning you from the platform." 
-        channel = await self.offending_message.author.create_dm()
-        await channel.send(msg)
-        return [f'{self.incident_prefix} @{self.offending_message.author.name} is now banned.']
+        for m in self.authors():
+            msg = "Our moderators believe that this message violates our policies around threatening, promoting, or glorifying violence"
+            msg += "```" + m.author_name + ": " + m.content + "```\n"
+            msg += "We are therefore banning you from the platform." 
+            await self.client.dispatcher.send_dm(await self.get_author(m), msg)
+        return [f'{self.incident_prefix} {self.mention_authors()} {"is" if len(self.authors()) == 1 else "are"} now banned.']
 
     async def send_self_help_message(self):
-        msg = "Hi there! We're worried about the message you sent:\n"
-        msg += "```" + self.offending_message.author.name + ": " + self.offending_message.content + "```\n"
-        msg += "We want you to know that there is help. You can reach the suicide prevention hotline in the US at 800-273-8255."
-        channel = await self.offending_message.author.create_dm()
-        await channel.send(msg)
-        return [f'{self.incident_prefix} We sent a message to @{self.offending_message.author.name} with supportive resources. Incident closed.']
\ No newline at end of file
+        for m in self.authors():
+            msg = "Hi there! We're worried about the message you sent:\n"
+            msg += "```" + m.author_name + ": " + m.content + "```\n"
+            msg += "We want you to know that there is help. You can reach the suicide prevention hotline in the US at 800-273-8255."
+            await self.client.dispatcher.send_dm(await self.get_author(m), msg)
+        return [f'{self.incident_prefix} We sent a message to {self.mention_authors()} with supportive resources. Incident closed.']
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+from PIL import Image
+
+
+def _dct_matrix(n: int) -> numpy.ndarray:
+    k = numpy.arange(n).reshape(-1, 1)
+    i = numpy.arange(n).reshape(1, -1)
+    return numpy.cos(numpy.pi * (2 * i + 1) * k / (2 * n))
+
+DCT_32 = _dct_matrix(32)
+
+
+def phash(image: Image.Image) -> int:
+    '''
+    64-bit perceptual hash: the low 8x8 frequencies of a 32x32 grayscale DCT, thresholded at their median.
+    Re-encoded, resized or slightly recompressed copies of an image land within a few bits of each other.
+    '''
+    pixels = numpy.asarray(image.convert('L').resize((32, 32), Image.LANCZOS), dtype=numpy.float64)
+    low = (DCT_32 @ pixels @ DCT_32.T)[:8, :8].flatten()
+    h = 0
+    for bit in low > numpy.median(low):
+        h = (h << 1) | int(bit)
+    return h
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def frame_indices(image: Image.Image, max_frames: int) -> List[int]:
+    '''
+    Up to max_frames evenly spaced frame indices of an animated GIF/WebP (just [0] for still images).
+    '''
+    n = getattr(image, 'n_frames', 1)
+    step = max(1, n // max_frames)
+    return list(range(0, n, step))[:max_frames]
+
+
+def frames_at(image: Image.Image, indices: List[int]) -> List[Tuple[int, Image.Image]]:
+    '''
+    The given frames, seeking to each one instead of decoding the whole animation.
+    '''
+    frames = []
+    for index in sorted(indices):
+        image.seek(index)
+        frames.append((index, image.copy()))
+    return frames
+
+
+def sample_frames(image: Image.Image, max_frames: int) -> List[Tuple[int, Image.Image]]:
+    return frames_at(image, frame_indices(image, max_frames))
+
+
+def frame_key(h: int, size: Tuple[int, int]) -> str:
+    return f'{h:016x}:{size[0]}x{size[1]}'
+
+
+def distinct_frame_hashes(image: Image.Image, max_frames: int = 8, max_distance: int = 4) -> List[Tuple[int, str]]:
+    '''
+    (frame index, cache key) for the sampled frames, skipping frames within max_distance bits of one already kept.
+    The key is the frame's exact pHash and dimensions: near-duplicates are only merged within one image, since two
+    captions on the same meme template can be just a few bits apart.
+    '''
+    kept = []
+    for index, frame in sample_frames(image, max_frames):
+        h = phash(frame)
+        if all(hamming(h, other) > max_distance for _, _, other in kept):
+            kept.append((index, frame_key(h, frame.size), h))
+    return [(index, key) for index, key, _ in kept]
+
+
+class OcrCache:
+    '''
+    OCR text keyed three ways: by Discord attachment ID, by SHA-256 of the downloaded bytes and by
+    per-frame perceptual hash plus dimensions (an exact match, so re-uploads of the same picture hit but
+    different captions on one template don't). The most recent `max_entries` of each are kept in memory;
+    everything is also written to a SQLite file so reposts are recognised across restarts.
+    SQLite (and hashing the bytes) runs on one worker thread, which opens the connection on first use,
+    so lookups never block the event loop.
+    '''
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.by_attachment: "OrderedDict[int, str]" = OrderedDict()
+        self.by_sha: "OrderedDict[str, str]" = OrderedDict()
+        self.by_phash: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.db: sqlite3.Connection = None
+
+    # These run on the worker thread
+    def _connection(self) -> sqlite3.Connection:
+        if self.db is None:
+            # WAL and a generous timeout so several bot processes can share the file
+            self.db = sqlite3.connect(self.path, timeout=30)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS ocr (kind TEXT, key TEXT, text TEXT, PRIMARY KEY (kind, key))')
+            self.db.commit()
+        return self.db
+
+    def _select(self, kind: str, key: str) -> Optional[str]:
+        row = self._connection().execute('SELECT text FROM ocr WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return row[0] if row is not None else None
+
+    def _insert(self, rows: List[Tuple[str, str, str]]):
+        db = self._connection()
+        db.executemany('INSERT OR REPLACE INTO ocr (kind, key, text) VALUES (?, ?, ?)', rows)
+        db.commit()
+
+    def _close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _remember(self, table: OrderedDict, key, text: str):
+        table[key] = text
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    async def _lookup(self, table: OrderedDict, kind: str, key) -> Optional[str]:
+        text = table.get(key)
+        if text is None:
+            text = await self._run(self._select, kind, str(key))
+            if text is None:
+                self.misses += 1
+                return None
+        self._remember(table, key, text)
+        self.hits += 1
+        return text
+
+    async def digest(self, data: bytes) -> str:
+        return await self._run(lambda: hashlib.sha256(data).hexdigest())
+
+    async def get_attachment(self, attachment_id: int) -> Optional[str]:
+        return await self._lookup(self.by_attachment, 'attachment', attachment_id)
+
+    async def get_bytes(self, sha: str) -> Optional[str]:
+        return await self._lookup(self.by_sha, 'sha256', sha)
+
+    async def get_phash(self, key: str) -> Optional[str]:
+        return await self._lookup(self.by_phash, 'phash', key)
+
+    async def put(self, attachment_id: int, sha: str, text: str):
+        self._remember(self.by_attachment, attachment_id, text)
+        self._remember(self.by_sha, sha, text)
+        await self._run(self._insert, [('attachment', str(attachment_id), text), ('sha256', sha, text)])
+
+    async def put_phash(self, key: str, text: str):
+        self._remember(self.by_phash, key, text)
+        await self._run(self._insert, [('phash', key, text)])
+
+    async def close(self):
+        await self._run(self._close)
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses, 'phash_entries': len(self.by_phash)}
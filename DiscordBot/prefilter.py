@@ -0,0 +1,183 @@
+# Cheap screening in front of DistilBERT. Only messages that a stage flags (or a small random sample of the rest)
+# are sent on to the transformer; everything else is treated as non-violent.
+# Usage:
+#   python prefilter.py train cs152_data.csv   # fit the hashed n-gram model on the training split, save it to LINEAR_MODEL_PATH
+#   python prefilter.py eval cs152_data.csv    # per-stage pass-through rates and recall on the held-out split
+import csv
+import logging
+import os
+import pickle
+import random
+import re
+import sys
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger('discord')
+
+LEXICON_PATH = 'violence_lexicon.txt'
+LINEAR_MODEL_PATH = 'prefilter_model.pkl'
+# train and eval split the labeled data the same way, so eval only sees rows the linear stage wasn't fit on
+HELD_OUT_FRACTION = 0.2
+SPLIT_SEED = 152
+
+# A trailing * matches any word starting with the term (kill* matches kill, kills, killed, killing)
+DEFAULT_LEXICON = [
+    'kill*', 'murder*', 'shoot*', 'shot', 'shots', 'gun*', 'ak', 'ak47', 'rifle*', 'bomb*', 'explod*', 'stab*',
+    'knife', 'knives', 'hang*', 'lynch*', 'eradicat*', 'extermina*', 'slaughter*', 'massacre*', 'die', 'dies',
+    'dying', 'dead', 'death*', 'hurt*', 'beat*', 'punch*', 'attack*', 'burn*', 'blow up', 'blew up', 'destroy*',
+    'strangl*', 'chok*', 'regret it', 'deserve to live', 'wipe out', 'get rid of', 'i know where',
+]
+
+
+def load_lexicon(path: str = LEXICON_PATH) -> List[str]:
+    '''
+    One term per line (a trailing * matches word stems); blank lines and lines starting with # are ignored.
+    Falls back to DEFAULT_LEXICON.
+    '''
+    if not os.path.isfile(path):
+        return DEFAULT_LEXICON
+    with open(path) as f:
+        return [line.strip().lower() for line in f if line.strip() and not line.startswith('#')]
+
+
+class LexiconStage:
+    '''
+    Matches every lexicon term in one pass. All terms are compiled into a single alternation,
+    longest first, so the regex engine scans the message once instead of once per term.
+    Terms ending in * match any word with that stem. An empty lexicon matches nothing.
+    '''
+
+    def __init__(self, terms: Iterable[str]):
+        terms = sorted({t.lower() for t in terms}, key=len, reverse=True)
+        self.pattern = None
+        if terms:
+            alternatives = [re.escape(t[:-1]) + r'\w*' if t.endswith('*') else re.escape(t) for t in terms]
+            self.pattern = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+    def __call__(self, text: str) -> bool:
+        return self.pattern is not None and self.pattern.search(text) is not None
+
+
+class LinearStage:
+    '''
+    Hashed word/bigram features with logistic regression, trained from cs152_data.csv.
+    '''
+
+    def __init__(self, vectorizer, model, threshold: float):
+        self.vectorizer = vectorizer
+        self.model = model
+        self.threshold = threshold
+
+    @staticmethod
+    def train(texts: List[str], labels: List[int], threshold: float = 0.2) -> 'LinearStage':
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import LogisticRegression
+        vectorizer = HashingVectorizer(ngram_range=(1, 2), n_features=2 ** 18, alternate_sign=False, norm='l2')
+        model = LogisticRegression(max_iter=1000, class_weight='balanced')
+        model.fit(vectorizer.transform(texts), labels)
+        return LinearStage(vectorizer, model, threshold)
+
+    @staticmethod
+    def load(path: str = LINEAR_MODEL_PATH) -> Optional['LinearStage']:
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        return LinearStage(saved['vectorizer'], saved['model'], saved['threshold'])
+
+    def save(self, path: str = LINEAR_MODEL_PATH):
+        with open(path, 'wb') as f:
+            # Saved as a plain dict so the file loads the same whether it was written by this script or the bot
+            pickle.dump({'vectorizer': self.vectorizer, 'model': self.model, 'threshold': self.threshold}, f)
+
+    def __call__(self, text: str) -> bool:
+        return self.model.predict_proba(self.vectorizer.transform([text]))[0][1] >= self.threshold
+
+
+class Prefilter:
+    '''
+    Decides whether a message needs the transformer. A message is escalated if the lexicon matches,
+    otherwise if the linear model (when trained) flags it, otherwise with probability `sample_rate`
+    so we keep measuring what the cheap stages miss.
+    '''
+
+    STAGES = ['lexicon', 'linear', 'sampled', 'dropped']
+
+    def __init__(self, lexicon: LexiconStage, linear: Optional[LinearStage] = None, sample_rate: float = 0.02,
+                 log_every: int = 1000):
+        self.lexicon = lexicon
+        self.linear = linear
+        self.sample_rate = sample_rate
+        self.log_every = log_every
+        self.counts: Dict[str, int] = {stage: 0 for stage in self.STAGES}
+        self.total = 0
+
+    def stage_for(self, text: str) -> str:
+        if self.lexicon(text):
+            return 'lexicon'
+        if self.linear is not None and self.linear(text):
+            return 'linear'
+        if random.random() < self.sample_rate:
+            return 'sampled'
+        return 'dropped'
+
+    def should_classify(self, text: str) -> bool:
+        stage = self.stage_for(text)
+        self.counts[stage] += 1
+        self.total += 1
+        if self.total % self.log_every == 0:
+            logger.info(f'Prefilter pass-through rates: {self.stats()}')
+        return stage != 'dropped'
+
+    def stats(self) -> Dict[str, float]:
+        return {stage: count / self.total if self.total else 0.0 for stage, count in self.counts.items()}
+
+
+def read_labeled_csv(path: str):
+    texts, labels = [], []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            texts.append(row['text'])
+            labels.append(int(row['labels']))
+    return texts, labels
+
+
+def split(texts: List[str], labels: List[int]):
+    '''
+    The same shuffled (train, held-out) split of the labeled rows every time, as (texts, labels) pairs.
+    '''
+    order = list(range(len(texts)))
+    random.Random(SPLIT_SEED).shuffle(order)
+    cut = int(len(order) * HELD_OUT_FRACTION)
+    test, train = sorted(order[:cut]), sorted(order[cut:])
+    return ([texts[n] for n in train], [labels[n] for n in train]), ([texts[n] for n in test], [labels[n] for n in test])
+
+
+def evaluate(prefilter: Prefilter, texts: List[str], labels: List[int]):
+    stages = [prefilter.stage_for(text) for text in texts]
+    positives = sum(labels)
+    print(f"{len(texts)} messages, {positives} labeled violent")
+    for stage in Prefilter.STAGES:
+        n = stages.count(stage)
+        print(f"  {stage}: {n} ({n / len(texts):.1%})")
+    escalated = [s != 'dropped' for s in stages]
+    print(f"sent to DistilBERT: {sum(escalated) / len(texts):.1%}")
+    if positives:
+        lexicon_recall = sum(1 for s, l in zip(stages, labels) if l and s == 'lexicon') / positives
+        total_recall = sum(1 for e, l in zip(escalated, labels) if l and e) / positives
+        print(f"recall of violent messages: lexicon {lexicon_recall:.1%}, all stages {total_recall:.1%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ('train', 'eval'):
+        print("Usage: python prefilter.py train|eval cs152_data.csv")
+        sys.exit(1)
+    (train_texts, train_labels), (test_texts, test_labels) = split(*read_labeled_csv(sys.argv[2]))
+    if sys.argv[1] == 'train':
+        LinearStage.train(train_texts, train_labels).save()
+        print(f"Saved linear stage to {LINEAR_MODEL_PATH} ({len(train_texts)} training rows, "
+              f"{len(test_texts)} held out for eval)")
+    else:
+        print(f"Held-out split ({HELD_OUT_FRACTION:.0%} of rows, seed {SPLIT_SEED}); "
+              f"retrain if the linear stage was fit on all of the data")
+        evaluate(Prefilter(LexiconStage(load_lexicon()), LinearStage.load(), sample_rate=0.0), test_texts, test_labels)
@@ -0,0 +1,327 @@
+# Offline throughput benchmark: replays a message trace through ModBot against fake Discord objects, so no
+# token or network is needed. Channel messages, edits, attachments, DM reports and moderator reactions all go
+# through the same handlers discord.py would call.
+# Usage:
+#   python replay.py                           # synthetic trace, stub classifier
+#   python replay.py --csv cs152_data.csv      # replay rows from the notebook's dataset
+#   python replay.py --real-model --rate 200   # use best_model instead of the stub
+#   python replay.py --real-ocr                # download and OCR attachments (served locally) instead of the stub
+#   python replay.py --send-rate 1.0           # pace sends like Discord does (posting incidents then takes minutes)
+import argparse
+import asyncio
+import csv
+import io
+import itertools
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, List
+
+import discord
+from aiohttp import web
+
+import bot as bot_module
+from bot import ModBot
+
+GROUP_NUM = 1
+BOT_USER_ID = 1
+api_calls: Counter = Counter()
+ids = itertools.count(1000)
+# With --real-ocr, attachments are served from a local HTTP server (see serve_attachments)
+ATTACHMENT_BASE_URL = None
+ATTACHMENT_CAPTIONS = ["I will kill them all next round", "see you at school tomorrow", "gg the game tonight was so bad", "lol"]
+
+
+class FakeUser:
+    def __init__(self, name: str, user_id: int = None):
+        self.id = user_id if user_id is not None else next(ids)
+        self.name = name
+        self.dm_channel = None
+
+    async def create_dm(self):
+        api_calls['create_dm'] += 1
+        if self.dm_channel is None:
+            self.dm_channel = FakeChannel(f'dm-{self.name}', None)
+        return self.dm_channel
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, size: int = 200 * 1024):
+        self.id = next(ids)
+        self.filename = filename
+        self.url = f'{ATTACHMENT_BASE_URL}/{self.id}/{filename}'
+        self.size = size
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeUser, channel: 'FakeChannel', attachments: List[FakeAttachment] = ()):
+        self.id = next(ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.attachments = list(attachments)
+
+    async def delete(self):
+        api_calls['delete'] += 1
+
+    async def edit(self, content: str):
+        api_calls['edit'] += 1
+        self.content = content
+        return self
+
+
+class FakeChannel:
+    def __init__(self, name: str, guild: 'FakeGuild'):
+        self.id = next(ids)
+        self.name = name
+        self.guild = guild
+        self.messages: Dict[int, FakeMessage] = {}
+
+    async def send(self, content: str):
+        api_calls['send'] += 1
+        message = FakeMessage(content, BOT_USER, self)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id: int):
+        api_calls['fetch_message'] += 1
+        if message_id not in self.messages:
+            raise discord.errors.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+        return self.messages[message_id]
+
+
+class FakeGuild:
+    def __init__(self, name: str):
+        self.id = next(ids)
+        self.name = name
+        self.text_channels: List[FakeChannel] = []
+
+    def add_channel(self, name: str) -> FakeChannel:
+        channel = FakeChannel(name, self)
+        self.text_channels.append(channel)
+        return channel
+
+    def get_channel(self, channel_id: int):
+        return next((c for c in self.text_channels if c.id == channel_id), None)
+
+
+BOT_USER = FakeUser(f'Group {GROUP_NUM} Bot', BOT_USER_ID)
+
+
+class ReplayBot(ModBot):
+    '''
+    ModBot with the gateway replaced by the fake guild above.
+    '''
+
+    def __init__(self, guild: FakeGuild, nlp):
+        super().__init__(None, nlp=nlp)
+        self.fake_guild = guild
+
+    @property
+    def user(self):
+        return BOT_USER
+
+    @property
+    def guilds(self):
+        return [self.fake_guild]
+
+    def get_guild(self, guild_id):
+        return self.fake_guild if guild_id == self.fake_guild.id else None
+
+    def get_channel(self, channel_id):
+        return self.fake_guild.get_channel(channel_id)
+
+
+class StubOcr:
+    '''
+    Stands in for OcrPool: returns canned text after a fixed delay instead of downloading and running Tesseract.
+    '''
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def get_text_from_attachments(self, attachments) -> str:
+        await asyncio.sleep(self.latency)
+        return " ".join("screenshot text" for _ in attachments)
+
+    async def close(self):
+        pass
+
+
+def attachment_images() -> List[bytes]:
+    '''
+    A PNG screenshot of each caption, black text on white.
+    '''
+    from PIL import Image, ImageDraw, ImageFont
+    font = ImageFont.load_default(size=32)
+    images = []
+    for caption in ATTACHMENT_CAPTIONS:
+        image = Image.new('RGB', (800, 200), 'white')
+        ImageDraw.Draw(image).text((20, 80), caption, fill='black', font=font)
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        images.append(buffer.getvalue())
+    return images
+
+
+async def serve_attachments() -> web.AppRunner:
+    '''
+    Serves attachment_images() on a free local port, so --real-ocr downloads real bytes without the network.
+    Attachments cycle through the captions by ID, so repeats exercise the OCR cache.
+    '''
+    global ATTACHMENT_BASE_URL
+    images = attachment_images()
+
+    async def handle(request):
+        return web.Response(body=images[int(request.match_info['id']) % len(images)], content_type='image/png')
+
+    app = web.Application()
+    app.router.add_get('/{id}/{filename}', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    ATTACHMENT_BASE_URL = f'http://127.0.0.1:{runner.addresses[0][1]}'
+    return runner
+
+
+def stub_nlp(texts):
+    time.sleep(0.0005 * len(texts))
+    return [{'label': 'LABEL_1' if 'kill' in t.lower() else 'LABEL_0', 'score': 0.99} for t in texts]
+
+
+def load_trace(args) -> List[str]:
+    if args.csv:
+        with open(args.csv, newline='', encoding='utf-8') as f:
+            texts = [row['text'] for row in csv.DictReader(f)]
+        return texts[:args.messages]
+    rng = random.Random(152)
+    words = "lol gg the game tonight was so bad honestly I will kill them all next round see you at school".split()
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(1, 25))) for _ in range(args.messages)]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def measure_loop_lag(lags: List[float], stop: asyncio.Event, interval: float = 0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def report_flow(client: ReplayBot, reporter: FakeUser, target: FakeMessage):
+    dm = await reporter.create_dm()
+    link = f'https://discord.com/channels/{target.guild.id}/{target.channel.id}/{target.id}'
+    for content in ['report', link, 'harm', 'yes']:
+        await client.on_message(FakeMessage(content, reporter, dm))
+
+
+async def replay(args):
+    guild = FakeGuild('Replay Guild')
+    channel = guild.add_channel(f'group-{GROUP_NUM}')
+    mod_channel = guild.add_channel(f'group-{GROUP_NUM}-mod')
+    users = [FakeUser(f'user{i}') for i in range(50)]
+
+    nlp = None if args.real_model else stub_nlp
+    client = ReplayBot(guild, nlp)
+    attachment_server = None
+    if args.real_ocr:
+        attachment_server = await serve_attachments()
+    else:
+        client.ocr = StubOcr(args.ocr_latency)
+    client.triage.start()
+    await client.load_models()
+    await client.on_ready()
+
+    trace = load_trace(args)
+    rng = random.Random(152)
+    latencies: List[float] = []
+    lags: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lags, stop))
+
+    async def timed(coro):
+        start = time.perf_counter()
+        await coro
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    sent_messages: List[FakeMessage] = []
+    start = time.perf_counter()
+    for n, text in enumerate(trace):
+        attachments = [FakeAttachment('meme.png')] if rng.random() < args.attachment_rate else []
+        message = FakeMessage(text, rng.choice(users), channel, attachments)
+        channel.messages[message.id] = message
+        sent_messages.append(message)
+        tasks.append(asyncio.create_task(timed(client.on_message(message))))
+        if rng.random() < args.edit_rate:
+            tasks.append(asyncio.create_task(timed(client.on_message_edit(message, message))))
+        if rng.random() < args.report_rate:
+            tasks.append(asyncio.create_task(report_flow(client, rng.choice(users), rng.choice(sent_messages))))
+        # Pace the trace at the requested rate
+        await asyncio.sleep(max(0.0, start + (n + 1) / args.rate - time.perf_counter()))
+    await asyncio.gather(*tasks)
+    # The handlers are done here; what's left is posting incidents, which is paced by --send-rate
+    handled = time.perf_counter() - start
+    await client.triage.join()
+    drained = time.perf_counter() - start - handled
+
+    # Moderators react to every incident message posted so far
+    reactions = [asyncio.create_task(timed(client.on_raw_reaction_add(SimpleNamespace(
+        guild_id=guild.id, channel_id=mod_channel.id, message_id=message_id, emoji=SimpleNamespace(name='👎')))))
+        for message_id in list(mod_channel.messages)]
+    await asyncio.gather(*reactions)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await lag_task
+    await client.triage.stop()
+    await client.classifier.stop()
+    await client.ocr.close()
+    await client.incidents.close()
+    if attachment_server is not None:
+        await attachment_server.cleanup()
+
+    print(f"{len(trace)} messages handled in {handled:.2f}s ({len(trace) / handled:.1f} msgs/s)")
+    print(f"incident posts drained {drained:.2f}s later; {elapsed:.2f}s in total including moderator reactions")
+    print(f"handler latency: p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p95 {percentile(latencies, 0.95) * 1000:.1f}ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+    print(f"event loop lag: p50 {percentile(lags, 0.5) * 1000:.1f}ms, max {max(lags, default=0) * 1000:.1f}ms")
+    print(f"API calls: {dict(api_calls)}")
+    print(f"classifier: {client.classifier.stats()}")
+    print(f"verdict cache: {client.verdict_cache.stats()}")
+    print(f"triage: {client.triage.stats()}")
+    print(f"reactions routed {client.reactions_routed}, fallback {client.reactions_fallback}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a message trace through ModBot without Discord")
+    parser.add_argument('--csv', help="replay the text column of this CSV (e.g. cs152_data.csv)")
+    parser.add_argument('--messages', type=int, default=1000, help="number of channel messages to replay")
+    parser.add_argument('--rate', type=float, default=100, help="channel messages per second")
+    parser.add_argument('--attachment-rate', type=float, default=0.1, help="fraction of messages with an image")
+    parser.add_argument('--edit-rate', type=float, default=0.05, help="fraction of messages that are edited")
+    parser.add_argument('--report-rate', type=float, default=0.02, help="fraction of messages followed by a DM report")
+    parser.add_argument('--ocr-latency', type=float, default=0.2, help="seconds the stub OCR takes per message")
+    parser.add_argument('--real-model', action='store_true', help="classify with best_model instead of a stub")
+    parser.add_argument('--real-ocr', action='store_true', help="use the real OCR pool (needs Tesseract) on locally served images")
+    # Unpaced by default, so the run measures the bot rather than Discord's per-channel limit
+    parser.add_argument('--send-rate', type=float, default=1000.0,
+                        help=f"per-channel sends per second (the bot uses {bot_module.SEND_RATE})")
+    args = parser.parse_args()
+
+    # Keep the replay's caches, incidents and log out of the bot's real files
+    workdir = tempfile.mkdtemp(prefix='replay-')
+    bot_module.VERDICT_CACHE_PATH = os.path.join(workdir, 'verdict_cache.json')
+    bot_module.INCIDENT_DB_PATH = os.path.join(workdir, 'incidents.db')
+    bot_module.OCR_CACHE_PATH = os.path.join(workdir, 'ocr_cache.db')
+    bot_module.start_logging(os.path.join(workdir, 'discord.log'))
+    bot_module.SEND_RATE = args.send_rate
+    bot_module.METRICS_PORT = None
+    asyncio.run(replay(args))
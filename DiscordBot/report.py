@@ -22,6 +22,25 @@ class ReportType(Enum):
     INAPPROPIATE = 'inappropiate'
     HARM = 'harm'
 
+@dataclass
+class MessageSnapshot:
+    '''
+    The parts of a reported message we need while the report is in progress, instead of the whole discord.Message.
+    '''
+    id: int
+    guild_id: int
+    channel_id: int
+    author_id: int
+    author_name: str
+    content: str
+
+    @staticmethod
+    def of(message) -> 'MessageSnapshot':
+        if isinstance(message, MessageSnapshot):
+            return message
+        return MessageSnapshot(message.id, message.guild.id if message.guild else None, message.channel.id,
+                               message.author.id, message.author.name, message.content)
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
@@ -30,7 +49,7 @@ class Report:
     def __init__(self, client):
         self.state = State.REPORT_START
         self.client = client
-        self.message = None
+        self.message: MessageSnapshot = None
         self.threat_level = ThreatLevel.NOT_HARM
     
     async def handle_message(self, message: discord.Message):
@@ -57,21 +76,30 @@ class Report:
             m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
             if not m:
                 return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
+            # When the bot is sharded, the guild may belong to another process, so fall back to the REST API
             guild = self.client.get_guild(int(m.group(1)))
             if not guild:
-                return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
+                try:
+                    guild = await self.client.fetch_guild(int(m.group(1)))
+                except (discord.errors.NotFound, discord.errors.Forbidden):
+                    return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
             channel = guild.get_channel(int(m.group(2)))
+            if not channel:
+                try:
+                    channel = await self.client.fetch_channel(int(m.group(2)))
+                except (discord.errors.NotFound, discord.errors.Forbidden):
+                    channel = None
             if not channel:
                 return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
             try:
-                message = await channel.fetch_message(int(m.group(3)))
+                message = await self.client.message_cache.fetch(channel, int(m.group(3)))
             except discord.errors.NotFound:
                 return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
 
             # Here we've found the message - it's up to you to decide what to do next!
             self.state = State.MESSAGE_IDENTIFIED
 
-            self.message = message 
+            self.message = MessageSnapshot.of(message)
 
             reply = "I found this message:" + "```" + message.author.name + ": " + message.content + "```\n"
             reply += "What do you think is wrong with this message?\n\n"
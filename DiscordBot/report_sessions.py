@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import discord
+
+from report import MessageSnapshot, Report
+
+
+class MessageCache:
+    '''
+    Recently fetched messages by ID, so a viral message reported by many users is only fetched over REST once.
+    Bounded to `max_entries`; entries older than `ttl` seconds are fetched again in case the message was edited.
+    '''
+
+    def __init__(self, client, max_entries: int = 1000, ttl: float = 5 * 60):
+        self.client = client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.messages: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.fetches = 0
+
+    async def fetch(self, channel, message_id: int) -> discord.Message:
+        '''
+        Like channel.fetch_message, including raising discord.errors.NotFound, but answered from the cache when possible.
+        '''
+        entry = self.messages.get(message_id)
+        if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+            self.messages.move_to_end(message_id)
+            self.hits += 1
+            return entry[0]
+        self.fetches += 1
+        message = await channel.fetch_message(message_id)
+        self.messages[message_id] = (message, time.monotonic())
+        self.messages.move_to_end(message_id)
+        while len(self.messages) > self.max_entries:
+            self.messages.popitem(last=False)
+        return message
+
+    async def resolve(self, snapshot: MessageSnapshot) -> Optional[discord.Message]:
+        '''
+        The full message for a snapshot, or None if it has been deleted or we can't see it anymore.
+        '''
+        try:
+            channel = self.client.get_channel(snapshot.channel_id) or await self.client.fetch_channel(snapshot.channel_id)
+            return await self.fetch(channel, snapshot.id)
+        except (discord.errors.NotFound, discord.errors.Forbidden):
+            return None
+
+
+class ReportSessions:
+    '''
+    The in-progress Report for each user, by user ID. A session that sees no messages for `idle_timeout`
+    seconds is dropped, and when more than `max_sessions` are open the least recently active is dropped.
+    Users whose session was dropped are remembered for a while so they can be told why.
+    '''
+
+    def __init__(self, client, idle_timeout: float = 15 * 60, max_sessions: int = 1000):
+        self.client = client
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        # user ID -> (report, last active), least recently active first
+        self.sessions: "OrderedDict[int, tuple]" = OrderedDict()
+        self.timed_out: "OrderedDict[int, None]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _drop(self, author_id: int):
+        self.sessions.pop(author_id)
+        self.timed_out[author_id] = None
+        while len(self.timed_out) > self.max_sessions:
+            self.timed_out.popitem(last=False)
+
+    def sweep(self):
+        now = time.monotonic()
+        while self.sessions:
+            author_id, (_, last_active) = next(iter(self.sessions.items()))
+            if now - last_active <= self.idle_timeout:
+                break
+            self._drop(author_id)
+
+    def get(self, author_id: int) -> Optional[Report]:
+        self.sweep()
+        if author_id not in self.sessions:
+            return None
+        report, _ = self.sessions.pop(author_id)
+        self.sessions[author_id] = (report, time.monotonic())
+        return report
+
+    def start(self, author_id: int) -> Report:
+        self.timed_out.pop(author_id, None)
+        report = Report(self.client)
+        self.sessions[author_id] = (report, time.monotonic())
+        while len(self.sessions) > self.max_sessions:
+            self._drop(next(iter(self.sessions)))
+        return report
+
+    def end(self, author_id: int):
+        self.sessions.pop(author_id, None)
+
+    def was_dropped(self, author_id: int) -> bool:
+        '''
+        True (once) if this user's session was dropped for being idle or over the cap.
+        '''
+        if author_id in self.timed_out:
+            del self.timed_out[author_id]
+            return True
+        return False
@@ -0,0 +1,51 @@
+# Runs the bot as several processes: inference servers that each hold one copy of best_model, and bot
+# processes that each run a slice of the gateway shards and classify through the inference servers.
+# Incidents are shared through the SQLite incident database, so any process can handle any reaction.
+# Each bot process writes its own log (discord-<n>.log) and verdict cache (verdict_cache-<n>.json).
+# Usage: python run_sharded.py [bot processes] [shards per process] [inference servers] [pytorch|quantized|onnx]
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Bot process n serves its metrics on METRICS_PORT + n (METRICS_PORT as in bot.py)
+METRICS_PORT = 9152
+
+if __name__ == "__main__":
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    shards_per_process = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    servers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    # The bots need to know the backend too: it's part of the verdict cache's fingerprint
+    backend = sys.argv[4] if len(sys.argv) > 4 else 'pytorch'
+    shard_count = processes * shards_per_process
+
+    socket_dir = tempfile.mkdtemp(prefix='modbot-')
+    sockets = [os.path.join(socket_dir, f'inference-{i}.sock') for i in range(servers)]
+    children = [subprocess.Popen([sys.executable, 'inference_server.py', path, backend]) for path in sockets]
+
+    # Wait for the servers to load the model before the shards start sending them messages
+    while not all(os.path.exists(path) for path in sockets):
+        if any(child.poll() is not None for child in children):
+            sys.exit("An inference server exited before it was ready")
+        time.sleep(0.5)
+
+    for p in range(processes):
+        shard_ids = range(p * shards_per_process, (p + 1) * shards_per_process)
+        children.append(subprocess.Popen([
+            sys.executable, 'bot.py',
+            '--shard-ids', ','.join(str(s) for s in shard_ids),
+            '--shard-count', str(shard_count),
+            '--inference-sockets', ','.join(sockets),
+            '--metrics-port', str(METRICS_PORT + p),
+            '--backend', backend,
+            '--log-path', f'discord-{p}.log',
+            '--verdict-cache-path', f'verdict_cache-{p}.json',
+        ]))
+
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from mod_flow import Incident
+
+logger = logging.getLogger('discord')
+
+
+class TriageQueue:
+    '''
+    Incidents waiting to be posted (or re-posted after new reports) in the mod channels, most urgent first.
+    Urgency is Incident.priority(): threat level, then classifier score, then number of reports.
+    An incident is queued at most once; pushing it again while it waits just moves it to its new priority,
+    so a burst of reports about the same message turns into one post or edit.
+    '''
+
+    def __init__(self, publish: Callable[[Incident], Awaitable[None]]):
+        self.publish = publish
+        self.heap: List[Tuple[tuple, int, int]] = []
+        # incident number -> (incident, the priority it is queued under); heap entries that don't match are stale
+        self.queued: Dict[int, Tuple[Incident, tuple]] = {}
+        self.order = itertools.count()
+        self.wakeup: asyncio.Event = None
+        self.idle: asyncio.Event = None
+        self.worker = None
+        self.published = 0
+        self.merged = 0
+
+    def __len__(self):
+        return len(self.queued)
+
+    def start(self):
+        # Must be called from inside the running event loop (e.g. on_ready)
+        if self.worker is None:
+            self.wakeup = asyncio.Event()
+            self.idle = asyncio.Event()
+            self.idle.set()
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def push(self, incident: Incident):
+        if incident.incident_num in self.queued:
+            self.merged += 1
+        priority = incident.priority()
+        self.queued[incident.incident_num] = (incident, priority)
+        heapq.heappush(self.heap, (priority, next(self.order), incident.incident_num))
+        self.idle.clear()
+        self.wakeup.set()
+
+    def _pop(self) -> Incident:
+        while self.heap:
+            priority, _, incident_num = heapq.heappop(self.heap)
+            entry = self.queued.get(incident_num)
+            if entry is not None and entry[1] == priority:
+                del self.queued[incident_num]
+                return entry[0]
+        return None
+
+    async def _run(self):
+        while True:
+            incident = self._pop()
+            if incident is None:
+                self.idle.set()
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            try:
+                await self.publish(incident)
+            except Exception:
+                logger.exception(f'Could not post incident {incident.incident_num} to the mod channels')
+            self.published += 1
+
+    async def join(self):
+        '''
+        Waits until every queued incident has been posted.
+        '''
+        await self.idle.wait()
+
+    def stats(self) -> Dict:
+        return {
+            'queued': len(self.queued),
+            'published': self.published,
+            'merged': self.merged,
+        }
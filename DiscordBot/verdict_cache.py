@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger('discord')
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode('utf-8')).hexdigest()
+
+
+def model_fingerprint(model_dir: str) -> str:
+    '''
+    Identifies a checkpoint by the name, size and modification time of its files, so retraining
+    or swapping best_model invalidates any verdicts cached for the old one.
+    '''
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        if name.endswith('.onnx'):
+            # Exported from the checkpoint by the onnx backend, not part of it
+            continue
+        st = os.stat(os.path.join(model_dir, name))
+        h.update(f'{name}:{st.st_size}:{st.st_mtime_ns};'.encode('utf-8'))
+    return h.hexdigest()
+
+
+class VerdictCache:
+    '''
+    Maps normalized message content to the classifier's verdict ({'label': ..., 'score': ...}).
+    Bounded with LRU eviction, entries expire after `ttl` seconds, and the whole cache is saved to
+    `path` as JSON so a restart doesn't start cold.
+    '''
+
+    def __init__(self, path: str, fingerprint: str, max_entries: int = 50000, ttl: float = 24 * 60 * 60):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def get(self, text: str) -> Optional[Dict]:
+        key = content_key(text)
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return {'label': entry['label'], 'score': entry['score']}
+
+    def put(self, text: str, verdict: Dict):
+        key = content_key(text)
+        self.entries[key] = {'label': verdict['label'], 'score': verdict['score'], 'time': time.time()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f'Could not read verdict cache at {self.path}, starting empty')
+            return
+        if data.get('fingerprint') != self.fingerprint:
+            logger.info('best_model changed since the verdict cache was saved, discarding it')
+            return
+        now = time.time()
+        for key, entry in data.get('entries', []):
+            if now - entry['time'] <= self.ttl:
+                self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def snapshot(self) -> Dict:
+        '''
+        What save() writes. Taking it is cheap, so the slow JSON encoding can happen in another thread.
+        '''
+        return {'fingerprint': self.fingerprint, 'entries': list(self.entries.items())}
+
+    def save(self, snapshot: Dict = None):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot if snapshot is not None else self.snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,23 +1,149 @@
 # Make sure you have trarnsformers  and torch installed
+# Usage:
+#   python violence_classifier.py "some text to classify"
+#   python violence_classifier.py eval cs152_data.csv --out predictions.jsonl --workers 4
+# The model and sklearn are only imported when they're needed, so a one-off classify starts quickly.
+import argparse
+import csv
+import json
+import os
 import sys
+from typing import Dict, Iterator, List, Tuple
 
-from transformers import pipeline
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-
-from sklearn.calibration import calibration_curve
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support
-import matplotlib.pyplot as plt
-#Loads the model from the folder 'best_model'
-first_model = AutoModelForSequenceClassification.from_pretrained('best_model', num_labels=2)
-tokenizer = AutoTokenizer.from_pretrained('distilbert-base-uncased')
-# Makes the model easy to use:
-# Usage: nlp(string or strings to classify)
-# Output = [{'labels': "LABEL_1", 'score': probability} for string in input]
-# Violent Content = LABEL_1, Non-Violent = LABEL_0
-nlp = pipeline("sentiment-analysis",model=first_model, tokenizer=tokenizer)
+nlp = None
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99]
+
+def get_nlp(backend: str = 'pytorch'):
+    # Loads the model from the folder 'best_model' the first time it's needed
+    # Makes the model easy to use, batching texts of similar length together:
+    # Usage: nlp(string or strings to classify)
+    # Output = [{'labels': "LABEL_1", 'score': probability} for string in input]
+    # Violent Content = LABEL_1, Non-Violent = LABEL_0
+    global nlp
+    if nlp is None:
+        from inference import load_engine
+        nlp = load_engine(backend, 'best_model')
+    return nlp
 
 def classify(sentances):
-    return nlp(sentances)  
+    return get_nlp()(sentances)
+
+def violent_probability(prediction: Dict) -> float:
+    return prediction['score'] if prediction['label'] == 'LABEL_1' else 1 - prediction['score']
+
+def read_rows(path: str) -> Iterator[Tuple[str, int]]:
+    '''
+    Yields (text, label) from a CSV with `text` and `labels` columns (like cs152_data.csv) or a JSONL file
+    with the same keys. The label is None when the file doesn't have one.
+    '''
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            label = row.get('labels')
+            yield row['text'], int(label) if label not in (None, '') else None
+
+def chunks(rows: Iterator, size: int) -> Iterator[List]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def init_worker(backend: str, workers: int):
+    # Each worker gets its share of the cores, otherwise every torch process uses all of them
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    get_nlp(backend)
+
+def classify_chunk(chunk: List[Tuple[str, int]]) -> List[Tuple[str, int, Dict]]:
+    predictions = get_nlp()([text for text, _ in chunk])
+    return [(text, label, prediction) for (text, label), prediction in zip(chunk, predictions)]
+
+def report(labels: List[int], probs: List[float], plot_path: str = None):
+    from sklearn.calibration import calibration_curve
+    from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+
+    predicted = [1 if p > 0.5 else 0 for p in probs]
+    precision, recall, f1, _ = precision_recall_fscore_support(labels, predicted, average='binary', zero_division=0)
+    print(f"accuracy {accuracy_score(labels, predicted):.4f}, precision {precision:.4f}, recall {recall:.4f}, f1 {f1:.4f}")
+
+    print("threshold sweep (violent if P(violent) > threshold):")
+    for threshold in THRESHOLDS:
+        predicted = [1 if p > threshold else 0 for p in probs]
+        precision, recall, f1, _ = precision_recall_fscore_support(labels, predicted, average='binary', zero_division=0)
+        print(f"  {threshold:.2f}: accuracy {accuracy_score(labels, predicted):.4f}, "
+              f"precision {precision:.4f}, recall {recall:.4f}, f1 {f1:.4f}")
+
+    true_frac, predicted_prob = calibration_curve(labels, probs, n_bins=10)
+    print("calibration (mean predicted P(violent) -> fraction actually violent):")
+    for p, t in zip(predicted_prob, true_frac):
+        print(f"  {p:.2f} -> {t:.2f}")
+    if plot_path:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        plt.figure()
+        plt.plot([0, 1], [0, 1], linestyle='--', color='gray')
+        plt.plot(predicted_prob, true_frac, marker='o')
+        plt.xlabel('Mean predicted P(violent)')
+        plt.ylabel('Fraction violent')
+        plt.title('Calibration')
+        plt.savefig(plot_path)
+
+def evaluate(args):
+    '''
+    Streams the file in chunks, classifies them across worker processes and writes each chunk's predictions
+    as soon as it's done. Metrics are computed from the collected scores at the end.
+    '''
+    import multiprocessing
+    labels, probs = [], []
+    out = open(args.out, 'w') if args.out else None
+    rows = chunks(read_rows(args.path), args.chunk_size)
+    if args.workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_worker, initargs=(args.backend, args.workers))
+        results = pool.imap(classify_chunk, rows)
+    else:
+        pool = None
+        get_nlp(args.backend)
+        results = map(classify_chunk, rows)
+    rows_done = 0
+    try:
+        for chunk in results:
+            rows_done += len(chunk)
+            for text, label, prediction in chunk:
+                prob = violent_probability(prediction)
+                if out is not None:
+                    out.write(json.dumps({'text': text, 'label': label, 'prediction': prediction['label'], 'p_violent': prob}) + '\n')
+                if label is not None:
+                    labels.append(label)
+                    probs.append(prob)
+            if out is not None:
+                out.flush()
+            print(f"classified {rows_done} rows", end='\r', file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+        if out is not None:
+            out.close()
+    print(file=sys.stderr)
+    if labels:
+        report(labels, probs, args.plot)
 
 if __name__=="__main__":
-  print(classify(' '.join(sys.argv)))
+    if len(sys.argv) > 1 and sys.argv[1] == 'eval':
+        parser = argparse.ArgumentParser(prog='violence_classifier.py eval')
+        parser.add_argument('path', help="CSV or JSONL file with a `text` column (and `labels` for metrics)")
+        parser.add_argument('--out', help="write one JSON prediction per line here")
+        parser.add_argument('--workers', type=int, default=1, help="number of processes classifying chunks")
+        parser.add_argument('--chunk-size', type=int, default=256, help="rows read and classified at a time")
+        parser.add_argument('--backend', default='pytorch', help="pytorch, quantized or onnx")
+        parser.add_argument('--plot', help="save a calibration plot to this file")
+        evaluate(parser.parse_args(sys.argv[2:]))
+    else:
+        print(classify(' '.join(sys.argv[1:])))